@@ -1,11 +1,26 @@
-from shop.models import Category, Order
+from shop.models import CartProduct, Order
+from shop.pagination import paginate_keyset
+from django.conf import settings
+from django.db.models import Prefetch
 from django.shortcuts import get_object_or_404
 
 
-def get_category():
-    return Category.objects.all()
-
-
 def delete_order(request, id):
     order = get_object_or_404(Order, id=id, customer=request.user, status='new')
     order.delete()
+
+
+def get_order_history(request):
+    """
+    Страница заказов пользователя: заказы с корзинами и строки с товарами - два запроса на страницу.
+    """
+    lines = CartProduct.objects.select_related('product').only('cart', 'product__name').order_by('id')
+    orders = Order.objects.filter(customer=request.user).select_related('cart').prefetch_related(
+        Prefetch('cart__cartproduct_set', queryset=lines))
+    return paginate_keyset(orders, request, settings.ORDERS_PAGE_SIZE, settings.ORDERS_PAGE_SIZE_MAX)
+
+
+def get_order_detail(request, id):
+    order = get_object_or_404(Order.objects.select_related('cart'), id=id, customer=request.user)
+    items = order.cart.cartproduct_set.select_related('product').order_by('id')
+    return order, items
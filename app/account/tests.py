@@ -1,3 +1,64 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 
-# Create your tests here.
+from shop.models import Cart, CartProduct, Category, Order, Product
+
+
+class OrderHistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Кольца', slug='rings')
+        cls.products = [Product.objects.create(name='Кольцо {0}'.format(i), slug='ring-{0}'.format(i),
+                                               category=category, image='r.png', qty=10, price=10 + i)
+                        for i in range(3)]
+        cls.user = User.objects.create_user('buyer')
+        cls.other = User.objects.create_user('other')
+        cls.orders = [cls.create_order(cls.user) for i in range(25)]
+        cls.other_order = cls.create_order(cls.other)
+
+    @classmethod
+    def create_order(cls, customer):
+        cart = Cart.objects.create(customer=customer, in_order=True, total_product=3, final_price=33)
+        CartProduct.objects.bulk_create(CartProduct(customer=customer, cart=cart, product=product, qty=1,
+                                                    final_price=product.price) for product in cls.products)
+        return Order.objects.create(customer=customer, cart=cart, first_name='Иван', last_name='Иванов',
+                                    phone='+375290000000', address='Минск')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def get_profile(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('profile'), params)
+        return len(queries), response
+
+    @override_settings(ORDERS_PAGE_SIZE=10)
+    def test_pages_use_constant_queries(self):
+        self.get_profile()
+        small, response = self.get_profile(limit=2)
+        large, response = self.get_profile()
+        self.assertEqual(small, large)
+        orders = response.context['orders']
+        self.assertEqual([order.id for order in orders], [order.id for order in self.orders[::-1][:10]])
+        self.assertContains(response, 'Кольцо 2', count=10)
+        self.assertNotContains(response, 'Информация о заказчике')
+        seen = [order.id for order in orders]
+        while orders.has_next():
+            orders = self.client.get(reverse('profile') + '?' + orders.next_query()).context['orders']
+            seen.extend(order.id for order in orders)
+        self.assertEqual(sorted(seen), sorted(order.id for order in self.orders))
+
+    def test_order_detail_fragment(self):
+        order = self.orders[0]
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('order_detail', args=[order.id]))
+        self.assertContains(response, 'Информация о заказчике')
+        self.assertContains(response, 'Кольцо 1')
+        self.assertContains(response, reverse('delete_order', args=[order.id]))
+
+    def test_order_detail_is_private(self):
+        response = self.client.get(reverse('order_detail', args=[self.other_order.id]))
+        self.assertEqual(response.status_code, 404)
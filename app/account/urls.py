@@ -7,6 +7,7 @@ urlpatterns = [
     path('login/', views.LoginView.as_view(), name='login'),
     path('reg/', views.RegistrationView.as_view(), name='reg'),
     path('logout/', LogoutView.as_view(), name='logout'),
-    path('delete-order/<int:id>/', views.DeleteOrderView.as_view(), name='delete_order')
+    path('delete-order/<int:id>/', views.DeleteOrderView.as_view(), name='delete_order'),
+    path('orders/<int:id>/', views.OrderDetailView.as_view(), name='order_detail'),
 
 ]
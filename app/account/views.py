@@ -1,6 +1,6 @@
 from django.shortcuts import render, redirect
 from django.views import View
-from shop.utils import CartMixin, CategoryMixin
+from shop.utils import CartMixin
 from django.contrib.auth.views import LoginView
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import logout
@@ -15,41 +15,40 @@ class ProfileView(CartMixin, View):
     template_name = 'account/profile.html'
 
     def get(self, request):
-        categories = get_category()
         context = {
             'cart': self.cart_view,
-            'categories': categories,
+            'orders': get_order_history(request),
         }
         return render(request, self.template_name, context)
 
 
+@method_decorator(login_required, name='dispatch')
+class OrderDetailView(View):
+    template_name = 'account/order_detail.html'
+
+    def get(self, request, id):
+        order, items = get_order_detail(request, id)
+        return render(request, self.template_name, {'order': order, 'items': items})
+
+
 class LoginView(LoginView):
     template_name = 'account/login.html'
     redirect_authenticated_user = True
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context['categories'] = get_category()
-        return context
-
 
 class RegistrationView(View):
     template_name = 'account/registration.html'
 
     def get(self, request):
         form = UserCreationForm()
-        categories = get_category()
         context = {
-            'categories': categories,
             'form': form
         }
         return render(request, self.template_name, context)
 
     def post(self, request):
         form = UserCreationForm(request.POST)
-        categories = get_category()
         context = {
-            'categories': categories,
             'form': form
         }
         if form.is_valid():
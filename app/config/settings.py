@@ -45,6 +45,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'shop.middleware.RecalcMiddleware',
+    'shop.middleware.CartStorageMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -60,6 +62,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'shop.context_processors.categories',
             ],
         },
     },
@@ -74,6 +77,10 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -89,6 +96,7 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+EMAIL_BACKEND = env('EMAIL_BACKEND', default='django.core.mail.backends.smtp.EmailBackend')
 EMAIL_HOST = env('EMAIL_HOST')
 EMAIL_HOST_USER = env('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = env('EMAIL_HOST_PASSWORD')
@@ -97,6 +105,10 @@ EMAIL_USE_TLS = env('EMAIL_USE_TLS')
 
 EMAIL_MESSAGE_TO = env('EMAIL_MESSAGE_TO')
 
+EMAIL_OUTBOX_MAX_ATTEMPTS = 5
+EMAIL_OUTBOX_BACKOFF = 60
+EMAIL_OUTBOX_LOCK_TIMEOUT = 10 * 60
+
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'profile'
 LOGOUT_REDIRECT_URL = 'main_page'
@@ -119,4 +131,31 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
 CART_SESSION_ID = 'cart'
+CART_STORAGE = env('CART_STORAGE', default='shop.cart_storage.CookieCartStorage')
+CART_COOKIE_NAME = 'cart'
+CART_COOKIE_AGE = 60 * 60 * 24 * 30
+CART_COOKIE_MAX_SIZE = 3800
+
+CATEGORY_NAV_CACHE_TIMEOUT = 60 * 60
+
+PRODUCTS_PAGE_SIZE = 24
+PRODUCTS_PAGE_SIZE_MAX = 96
+
+ORDERS_PAGE_SIZE = 10
+ORDERS_PAGE_SIZE_MAX = 50
+
+SEARCH_BACKEND = env('SEARCH_BACKEND', default='shop.search.SqliteSearchBackend')
+SEARCH_RESULTS_LIMIT = 500
+SUGGEST_LIMIT = 10
+
+PRODUCT_IMAGE_WIDTHS = [200, 400, 800]
+PRODUCT_IMAGE_QUALITY = 80
+
+SITEMAP_PAGE_SIZE = 5000
+SITEMAP_CACHE_TIMEOUT = 60 * 60 * 24
+
+PAGE_CACHE_TIMEOUT = 60 * 60
 
+API_PAGE_SIZE = 50
+API_PAGE_SIZE_MAX = 200
+API_CACHE_MAX_AGE = 60
@@ -3,8 +3,8 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from django.views.generic import TemplateView
-from django.contrib.sitemaps.views import sitemap
-from shop.sitemap import StaticSitemap, ItemSitemap, CategorySitemap
+from django.contrib.sitemaps.views import index, sitemap
+from shop.sitemap import StaticSitemap, ItemSitemap, CategorySitemap, cached_sitemap
 from django.contrib.staticfiles.views import serve
 from django.views.static import serve as media_serve
 
@@ -20,7 +20,9 @@ urlpatterns = [
     path('', include('shop.urls')),
     path('account/', include('account.urls')),
     path("robots.txt", TemplateView.as_view(template_name="robots.txt", content_type="text/plain")),
-    path('sitemap.xml', sitemap, {'sitemaps': sitemaps}, name='django.contrib.sitemaps.views.sitemap'),
+    path('sitemap.xml', cached_sitemap(index), {'sitemaps': sitemaps}, name='sitemap_index'),
+    path('sitemap-<section>.xml', cached_sitemap(sitemap), {'sitemaps': sitemaps},
+         name='django.contrib.sitemaps.views.sitemap'),
 ] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT) + static(settings.MEDIA_URL,  document_root=settings.MEDIA_ROOT)
 
 # if not settings.DEBUG:
@@ -1,4 +1,6 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 
 
 class MetaTags(models.Model):
@@ -13,3 +15,11 @@ class MetaTags(models.Model):
 
     def __str__(self):
         return self.url
+
+
+@receiver(post_delete, sender=MetaTags)
+@receiver(post_save, sender=MetaTags)
+def invalidate_meta_tags(**kwargs):
+    from .services import meta_tags_cache
+
+    transaction.on_commit(meta_tags_cache.bump_shared_version)
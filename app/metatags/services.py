@@ -0,0 +1,47 @@
+import threading
+
+from django.utils.html import format_html
+
+from shop.cache_version import bump_version, get_version
+
+from .models import MetaTags
+
+META_TAGS_VERSION_CACHE_KEY = 'metatags:version'
+
+
+class MetaTagsCache(object):
+    """
+    Вся таблица META-тегов в памяти процесса: url -> готовый HTML. Адреса без тегов
+    отвечают пустой строкой без запроса к БД. Таблица загружается заново целиком,
+    как только меняется META_TAGS_VERSION_CACHE_KEY.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.snippets = {}
+        self.version = None
+
+    def get_shared_version(self):
+        return get_version(META_TAGS_VERSION_CACHE_KEY)
+
+    def bump_shared_version(self):
+        bump_version(META_TAGS_VERSION_CACHE_KEY)
+        self.version = None
+
+    def load(self, version):
+        snippets = {
+            url: format_html('<meta name="description" content="{0}"> <meta name="keywords" content="{1}">',
+                             description, keywords)
+            for url, keywords, description in MetaTags.objects.values_list('url', 'keywords', 'description')
+        }
+        with self.lock:
+            self.snippets, self.version = snippets, version
+
+    def get(self, path):
+        version = self.get_shared_version()
+        if self.version != version:
+            self.load(version)
+        return self.snippets.get(path, '')
+
+
+meta_tags_cache = MetaTagsCache()
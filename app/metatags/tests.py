@@ -1,3 +1,70 @@
+from unittest import skipUnless
+
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from .models import MetaTags
+from .services import meta_tags_cache
+from .templatetags.meta_tags import meta_tags_include
+
+
+def run_commit_hooks():
+    """Колбэки transaction.on_commit внутри транзакции TestCase"""
+    callbacks, connection.run_on_commit = connection.run_on_commit, []
+    for sids, func in callbacks:
+        func()
+
+
+class MetaTagsCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        meta_tags_cache.version = None
+        MetaTags.objects.create(url='/', keywords='кольца, серьги', description='Магазин "Green"')
+
+    def test_hits_and_misses_without_queries(self):
+        meta_tags_include('/')
+        with CaptureQueriesContext(connection) as queries:
+            html = meta_tags_include('/')
+            for i in range(20):
+                self.assertEqual(meta_tags_include('/missing/{0}/'.format(i)), '')
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(html, '<meta name="description" content="Магазин &quot;Green&quot;"> '
+                               '<meta name="keywords" content="кольца, серьги">')
+
+    def test_save_and_delete_invalidate(self):
+        self.assertEqual(meta_tags_include('/about/'), '')
+        meta_tag = MetaTags.objects.create(url='/about/', keywords='о нас', description='Описание')
+        run_commit_hooks()
+        self.assertIn('о нас', meta_tags_include('/about/'))
+        meta_tag.keywords = 'контакты'
+        meta_tag.save()
+        run_commit_hooks()
+        self.assertIn('контакты', meta_tags_include('/about/'))
+        meta_tag.delete()
+        run_commit_hooks()
+        self.assertEqual(meta_tags_include('/about/'), '')
+
+    def test_other_process_change_detected_by_version(self):
+        meta_tags_include('/')
+        MetaTags.objects.filter(url='/').update(keywords='новые')
+        self.assertIn('кольца', meta_tags_include('/'))
+        cache.incr('metatags:version')
+        self.assertIn('новые', meta_tags_include('/'))
+
+    def test_version_is_bumped_after_commit(self):
+        meta_tags_include('/')
+        version = cache.get('metatags:version')
+        MetaTags.objects.create(url='/about/', keywords='о нас', description='Описание')
+        self.assertEqual(cache.get('metatags:version'), version)
+        run_commit_hooks()
+        self.assertNotEqual(cache.get('metatags:version'), version)
+
 
-# Create your tests here.
+@skipUnless(connection.vendor == 'sqlite', 'Планы запросов проверяются на SQLite')
+class MetaTagsQueryPlanTests(TestCase):
+    def test_url_lookup_uses_unique_index(self):
+        plan = MetaTags.objects.filter(url='/').explain()
+        self.assertNotRegex(plan, r'SCAN (TABLE )?metatags_metatags\b', plan)
+        self.assertIn('INDEX', plan)
@@ -1,8 +1,120 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
 from . import models
 from django import forms
-from django.utils.html import mark_safe
 from django.template.loader import render_to_string
+from django.shortcuts import render
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.db.models import Prefetch, Sum
+from .forms import ChangePriceForm
+from .order_export import stream_orders
+from .recalc import flush_recalc
+from .services import bulk_change_price
+from .templatetags.product_images import product_image
+
+
+class PaginatedRelatedFilter(admin.SimpleListFilter):
+    """
+    Фильтр по связанной модели, который показывает значения страницами по page_size,
+    а не загружает в боковую панель всех пользователей или все товары.
+    Номер страницы читается из запроса, а из условий списка его убирает PaginatedFilterChangeList.
+    """
+    field_name = None
+    label_field = None
+    page_size = 20
+
+    @classmethod
+    def get_page_parameter_name(cls):
+        return '{0}_page'.format(cls.parameter_name)
+
+    def __init__(self, request, params, model, model_admin):
+        self.page_parameter_name = self.get_page_parameter_name()
+        try:
+            self.page = max(1, int(request.GET.get(self.page_parameter_name, 1)))
+        except ValueError:
+            self.page = 1
+        self.has_next_page = False
+        super().__init__(request, params, model, model_admin)
+
+    def expected_parameters(self):
+        return [self.parameter_name, self.page_parameter_name]
+
+    def lookups(self, request, model_admin):
+        model = model_admin.model
+        related = model._meta.get_field(self.field_name).related_model
+        start = (self.page - 1) * self.page_size
+        values = list(related.objects.filter(pk__in=model.objects.values(self.field_name))
+                      .order_by(self.label_field).values_list('pk', self.label_field)[start:start + self.page_size + 1])
+        self.has_next_page = len(values) > self.page_size
+        return [(str(pk), label) for pk, label in values[:self.page_size]]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(**{self.field_name: self.value()})
+        return queryset
+
+    def choices(self, changelist):
+        yield from super().choices(changelist)
+        if self.page > 1:
+            yield {'selected': False, 'display': '← Предыдущие',
+                   'query_string': changelist.get_query_string({self.page_parameter_name: self.page - 1})}
+        if self.has_next_page:
+            yield {'selected': False, 'display': 'Следующие →',
+                   'query_string': changelist.get_query_string({self.page_parameter_name: self.page + 1})}
+
+
+class PaginatedFilterChangeList(ChangeList):
+    """
+    Параметры страниц фильтров не являются условиями отбора: они исключаются до создания фильтров,
+    поэтому не попадают в запрос и не делают фильтр активным.
+    """
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        for list_filter in self.list_filter:
+            if isinstance(list_filter, type) and issubclass(list_filter, PaginatedRelatedFilter):
+                lookup_params.pop(list_filter.get_page_parameter_name(), None)
+        return lookup_params
+
+
+class PaginatedFilterAdminMixin(object):
+    def get_changelist(self, request, **kwargs):
+        return PaginatedFilterChangeList
+
+
+class FlushRecalcMixin(object):
+    """
+    Остатки товаров и итоги корзин пересчитываются до выхода из транзакции админки,
+    а не после ответа (RecalcMiddleware): иначе между COMMIT и пересчетом страницы
+    каталога успели бы закэшироваться со старым наличием.
+    """
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        flush_recalc()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        flush_recalc()
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        flush_recalc()
+
+
+class CustomerFilter(PaginatedRelatedFilter):
+    title = 'Пользователь'
+    parameter_name = 'customer'
+    field_name = 'customer'
+    label_field = 'username'
+
+
+class ProductFilter(PaginatedRelatedFilter):
+    title = 'Продукт'
+    parameter_name = 'product'
+    field_name = 'product'
+    label_field = 'name'
 
 
 class CountProductValidation(forms.ModelForm):
@@ -25,18 +137,20 @@ class CategoryAdmin(admin.ModelAdmin):
     search_fields = ('name', 'slug')
 
 
-class CartProductAdmin(admin.ModelAdmin):
+class CartProductAdmin(FlushRecalcMixin, PaginatedFilterAdminMixin, admin.ModelAdmin):
     readonly_fields = ('final_price', 'get_image_100')
     list_display = ('id', 'customer', 'product', 'get_image', 'cart', 'qty', 'final_price',)
-    list_filter = ('customer', 'product')
-    search_fields = ('customer', 'product')
+    list_filter = (CustomerFilter, ProductFilter)
+    list_select_related = ('customer', 'product', 'cart__customer')
+    search_fields = ('customer__username', 'product__name')
+    show_full_result_count = False
     form = CountProductValidation
 
     def get_image(self, obj):
-        return mark_safe(f'<img src={obj.product.image.url} width="50">')
+        return product_image(obj.product.image, sizes='50px', width=50)
 
     def get_image_100(self, obj):
-        return mark_safe(f'<img src={obj.product.image.url} width="200">')
+        return product_image(obj.product.image, sizes='200px', width=200)
 
     get_image_100.short_description = 'Изображение'
     get_image.short_description = 'Изображение'
@@ -49,25 +163,36 @@ class CartProductInline(admin.TabularInline):
     form = CountProductValidation
 
     def get_image_100(self, obj):
-        return mark_safe(f'<img src={obj.product.image.url} width="200">')
+        return product_image(obj.product.image, sizes='200px', width=200)
 
     get_image_100.short_description = 'Изображение'
 
 
-class CartAdmin(admin.ModelAdmin):
+class CartAdmin(FlushRecalcMixin, PaginatedFilterAdminMixin, admin.ModelAdmin):
     list_display = ('id', 'customer', 'total_product', 'final_price', 'in_order')
     inlines = [CartProductInline, ]
-    list_filter = ('customer', 'in_order')
-    search_fields = ('customer', 'in_order')
+    list_filter = ('in_order', CustomerFilter)
+    list_select_related = ('customer',)
+    search_fields = ('customer__username',)
+    show_full_result_count = False
     readonly_fields = ('final_price', 'total_product')
 
 
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(PaginatedFilterAdminMixin, admin.ModelAdmin):
     list_display = ('id', 'first_name', 'last_name', 'phone', 'cart_product', 'final_price', 'status')
     list_editable = ('status',)
-    list_filter = ('first_name', 'last_name', 'status')
+    list_filter = ('status', CustomerFilter)
+    list_select_related = ('cart',)
     search_fields = ('first_name', 'last_name', 'status')
+    show_full_result_count = False
     readonly_fields = ('get_product_list',)
+    date_hierarchy = 'created_at'
+    actions = ['export_csv', 'export_jsonl']
+    export_chunk_size = 1000
+
+    def get_queryset(self, request):
+        lines = models.CartProduct.objects.select_related('product').only('cart', 'qty', 'product__name')
+        return super().get_queryset(request).prefetch_related(Prefetch('cart__cartproduct_set', queryset=lines))
 
     def cart_product(self, obj):
         cart_products = obj.cart.cartproduct_set.all()
@@ -79,9 +204,10 @@ class OrderAdmin(admin.ModelAdmin):
         return obj.cart.final_price
 
     final_price.short_description = 'Цена'
+    final_price.admin_order_field = 'cart__final_price'
 
     def get_product_list(self, obj):
-        cart_products = obj.cart.cartproduct_set.all()
+        cart_products = obj.cart.cartproduct_set.select_related('product')
         return render_to_string('shop/order_admin.html', {
             'cart_products': cart_products,
             'total_product': obj.cart.total_product,
@@ -90,18 +216,58 @@ class OrderAdmin(admin.ModelAdmin):
 
     get_product_list.short_description = 'Список товаров'
 
+    def export(self, queryset, file_format, content_type):
+        response = StreamingHttpResponse(stream_orders(queryset, file_format, self.export_chunk_size),
+                                         content_type=content_type)
+        response['Content-Disposition'] = 'attachment; filename="orders-{0}.{1}"'.format(
+            timezone.localdate().isoformat(), file_format)
+        return response
+
+    def export_csv(self, request, queryset):
+        return self.export(queryset, 'csv', 'text/csv; charset=utf-8')
+
+    def export_jsonl(self, request, queryset):
+        return self.export(queryset, 'jsonl', 'application/x-ndjson; charset=utf-8')
+
+    export_csv.short_description = 'Выгрузить в CSV'
+    export_csv.allowed_permissions = ('view',)
+    export_jsonl.short_description = 'Выгрузить в JSONL'
+    export_jsonl.allowed_permissions = ('view',)
+
 
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(FlushRecalcMixin, admin.ModelAdmin):
     list_display = ('id', 'name', 'qty', 'category', 'price', 'get_image')
+    list_select_related = ('category',)
     search_fields = ('name', 'category')
     readonly_fields = ('get_image_100',)
     inlines = [SizePanel]
+    actions = ['change_price']
 
     def get_image_100(self, obj):
-        return mark_safe(f'<img src={obj.image.url} width="200">')
+        return product_image(obj.image, sizes='200px', width=200)
+
+    def change_price(self, request, queryset):
+        if 'apply' in request.POST:
+            form = ChangePriceForm(request.POST)
+            if form.is_valid():
+                count = bulk_change_price(queryset, form.cleaned_data['mode'], form.cleaned_data['value'])
+                self.message_user(request, 'Цена изменена у {0} товаров'.format(count))
+                return None
+        else:
+            form = ChangePriceForm()
+        return render(request, 'admin/shop/product/change_price.html', {
+            **self.admin_site.each_context(request),
+            'title': 'Изменение цены',
+            'opts': self.model._meta,
+            'form': form,
+            'products': queryset,
+            'action_checkbox_name': admin.helpers.ACTION_CHECKBOX_NAME,
+        })
+
+    change_price.short_description = 'Изменить цену'
 
     def get_image(self, obj):
-        return mark_safe(f'<img src={obj.image.url} width="50">')
+        return product_image(obj.image, sizes='50px', width=50)
 
     get_image.short_description = 'Изображение'
     get_image_100.short_description = 'Изображение'
@@ -115,8 +281,9 @@ class ProductAdmin(admin.ModelAdmin):
         return ''
 
 
-class SizeAdmin(admin.ModelAdmin):
+class SizeAdmin(FlushRecalcMixin, admin.ModelAdmin):
     list_display = ('get_product__name', 'size')
+    list_select_related = ('product',)
     search_fields = ('product__name', 'size')
 
     def get_product__name(self, rec):
@@ -125,12 +292,60 @@ class SizeAdmin(admin.ModelAdmin):
     get_product__name.short_description = 'Товар'
 
 
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ('id', 'order', 'status', 'attempts', 'available_at', 'sent_at')
+    list_filter = ('status',)
+    readonly_fields = ('order', 'attempts', 'locked_at', 'sent_at', 'last_error', 'created_at')
+    list_select_related = ('order__customer',)
+
+
+class DailySalesAdmin(admin.ModelAdmin):
+    """
+    Отчет о продажах: читает только таблицу продаж по дням, заказы и корзины не затрагивает.
+    Итоги по дням и категориям считаются по тому же фильтру, что и список.
+    """
+    list_display = ('date', 'category', 'product', 'size', 'buying_type', 'orders', 'units', 'revenue')
+    list_filter = ('buying_type', 'category')
+    list_select_related = ('category', 'product')
+    date_hierarchy = 'date'
+    search_fields = ('product__name',)
+    show_full_result_count = False
+    summary_days = 31
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        response = super().changelist_view(request, extra_context)
+        changelist = getattr(response, 'context_data', {}).get('cl')
+        if changelist is None:
+            return response
+        rows = changelist.queryset.order_by()
+        totals = ('units', 'revenue')
+        response.context_data.update({
+            'sales_total': rows.aggregate(**{name: Sum(name) for name in totals}),
+            'sales_by_day': rows.values('date').annotate(**{name: Sum(name) for name in totals})
+                                .order_by('-date')[:self.summary_days],
+            'sales_by_category': rows.values('category__name').annotate(**{name: Sum(name) for name in totals})
+                                     .order_by('-revenue'),
+        })
+        return response
+
+
 admin.site.register(models.Category, CategoryAdmin)
 admin.site.register(models.Product, ProductAdmin)
 admin.site.register(models.CartProduct, CartProductAdmin)
 admin.site.register(models.Cart, CartAdmin)
 admin.site.register(models.Order, OrderAdmin)
 admin.site.register(models.Size, SizeAdmin)
+admin.site.register(models.EmailOutbox, EmailOutboxAdmin)
+admin.site.register(models.DailySales, DailySalesAdmin)
 
 admin.site.site_title = 'Ювелирный Магазин'
 admin.site.site_header = 'Ювелирный Магазин'
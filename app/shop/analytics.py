@@ -0,0 +1,98 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import CartProduct, DailySales, Order
+
+
+def counts_as_sale(status):
+    return status != Order.STATUS_CANCEL
+
+
+def get_sale_state(order):
+    """Поля заказа, от которых зависит его вклад в продажи"""
+    return order.status, order.created_at, order.buying_type
+
+
+def add_delta(deltas, key, category_id, orders, units, revenue):
+    row = deltas.setdefault(key, [category_id, 0, 0, Decimal(0)])
+    row[1] += orders
+    row[2] += units
+    row[3] += revenue
+
+
+def get_order_deltas(cart_id, previous, current):
+    """
+    Изменение продаж по ключу (день, товар, размер, тип доставки) при переходе заказа
+    из состояния previous в current; None - заказа нет (новый или удаленный).
+    """
+    states = [(state, sign) for state, sign in ((previous, -1), (current, 1))
+              if state is not None and counts_as_sale(state[0])]
+    if cart_id is None or not states:
+        return {}
+    lines = list(CartProduct.objects.filter(cart_id=cart_id)
+                 .values('product_id', 'product__category_id', 'size__size')
+                 .annotate(units=Sum('qty'), revenue=Sum('final_price')))
+    deltas = {}
+    for (status, created_at, buying_type), sign in states:
+        day = timezone.localtime(created_at).date()
+        for line in lines:
+            key = (day, line['product_id'], line['size__size'] or Decimal(0), buying_type)
+            add_delta(deltas, key, line['product__category_id'], sign, sign * line['units'], sign * line['revenue'])
+    return {key: row for key, row in deltas.items() if any(row[1:])}
+
+
+def update_order_sales(order, previous=None, current=None):
+    """
+    Инкрементальное обновление продаж при сохранении и удалении заказа: строки меняются
+    UPDATE ... SET units = units + n, пустые строки удаляются.
+    """
+    deltas = get_order_deltas(order.cart_id, previous, current)
+    if not deltas:
+        return
+    with transaction.atomic():
+        for (day, product_id, size, buying_type), (category_id, orders, units, revenue) in deltas.items():
+            updated = DailySales.objects.filter(
+                date=day, product_id=product_id, size=size, buying_type=buying_type
+            ).update(orders=F('orders') + orders, units=F('units') + units, revenue=F('revenue') + revenue)
+            if not updated and orders > 0:
+                DailySales.objects.create(date=day, product_id=product_id, category_id=category_id, size=size,
+                                          buying_type=buying_type, orders=orders, units=units, revenue=revenue)
+        if any(row[1] < 0 for row in deltas.values()):
+            DailySales.objects.filter(date__in={key[0] for key in deltas}, orders__lte=0).delete()
+
+
+def rebuild_daily_sales(chunk_size=1000):
+    """
+    Пересчет продаж по всем заказам. Заказы читаются пачками по chunk_size (по id), по одному
+    агрегирующему запросу на пачку; итоги копятся в памяти (по строке на ключ, а не на заказ)
+    и заменяют таблицу в одной транзакции, поэтому отчет не видит пустую или неполную таблицу.
+    Изменения заказов во время пересчета могут не попасть в итог: команду нужно запускать
+    при остановленном приеме заказов или повторить после.
+    Возвращает количество заказов.
+    """
+    last_id, total, deltas = 0, 0, {}
+    while True:
+        order_ids = list(Order.objects.filter(id__gt=last_id).exclude(status=Order.STATUS_CANCEL)
+                         .order_by('id').values_list('id', flat=True)[:chunk_size])
+        if not order_ids:
+            break
+        lines = (CartProduct.objects.filter(cart__order__id__in=order_ids)
+                 .values('product_id', 'product__category_id', 'size__size',
+                         day=TruncDate('cart__order__created_at'), buying_type=F('cart__order__buying_type'))
+                 .annotate(orders=Count('cart__order', distinct=True), units=Sum('qty'), revenue=Sum('final_price')))
+        for line in lines:
+            key = (line['day'], line['product_id'], line['size__size'] or Decimal(0), line['buying_type'])
+            add_delta(deltas, key, line['product__category_id'], line['orders'], line['units'], line['revenue'])
+        last_id = order_ids[-1]
+        total += len(order_ids)
+    rows = [DailySales(date=key[0], product_id=key[1], size=key[2], buying_type=key[3], category_id=category_id,
+                       orders=orders, units=units, revenue=revenue)
+            for key, (category_id, orders, units, revenue) in deltas.items()]
+    with transaction.atomic():
+        DailySales.objects.all().delete()
+        DailySales.objects.bulk_create(rows, batch_size=chunk_size)
+    return total
@@ -0,0 +1,89 @@
+from django.conf import settings
+from django.db.models import Prefetch
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_cache_control
+from django.views import View
+from django.views.decorators.http import condition
+
+from .models import Product, Size
+from .services import get_catalog_modified, get_catalog_version, get_category, search_product
+
+
+def get_etag(request, *args, **kwargs):
+    return 'catalog-{0}'.format(get_catalog_version())
+
+
+def get_last_modified(request, *args, **kwargs):
+    return get_catalog_modified()
+
+
+def get_api_products():
+    sizes = Size.objects.filter(qty__gt=0).order_by('size').only('product', 'size', 'qty')
+    return Product.objects.select_related('category').prefetch_related(Prefetch('size_set', queryset=sizes))
+
+
+def serialize_product(product):
+    return {
+        'id': product.id,
+        'slug': product.slug,
+        'name': product.name,
+        'category': product.category.slug,
+        'price': str(product.price),
+        'qty': product.qty,
+        'url': product.get_absolute_url(),
+        'image': product.image.url if product.image else None,
+        'sizes': [{'size': str(size.size.normalize()), 'qty': size.qty} for size in product.size_set.all()],
+    }
+
+
+class CatalogApiView(View):
+    """
+    Каталог в JSON только для чтения. ETag и Last-Modified берутся из поколения каталога в кэше,
+    поэтому повторный запрос с If-None-Match получает 304 без обращения к БД.
+    """
+    http_method_names = ['get', 'head', 'options']
+
+    def dispatch(self, request, *args, **kwargs):
+        view = condition(etag_func=get_etag, last_modified_func=get_last_modified)(super().dispatch)
+        response = view(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            patch_cache_control(response, public=True, max_age=settings.API_CACHE_MAX_AGE)
+        return response
+
+    def render(self, data):
+        return JsonResponse(data, json_dumps_params={'ensure_ascii': False, 'separators': (',', ':')})
+
+    def render_page(self, page, items):
+        return self.render({
+            'results': items,
+            'next': '{0}?{1}'.format(self.request.path, page.next_query()) if page.has_next() else None,
+            'previous': '{0}?{1}'.format(self.request.path, page.previous_query()) if page.has_previous() else None,
+        })
+
+
+class CategoryListApiView(CatalogApiView):
+    def get(self, request):
+        return self.render({'results': [
+            {'slug': category.slug, 'name': category.name, 'url': category.get_absolute_url(),
+             'products': category.product_count}
+            for category in get_category()
+        ]})
+
+
+class ProductListApiView(CatalogApiView):
+    """Товары страницами по курсору (after/before, limit), фильтры category и search"""
+
+    def get(self, request):
+        products = get_api_products().defer('description')
+        category = request.GET.get('category')
+        if category:
+            products = products.filter(category__slug=category)
+        page = search_product(products, request, settings.API_PAGE_SIZE, settings.API_PAGE_SIZE_MAX)
+        return self.render_page(page, [serialize_product(product) for product in page])
+
+
+class ProductDetailApiView(CatalogApiView):
+    def get(self, request, slug):
+        product = get_object_or_404(get_api_products(), slug=slug)
+        return self.render({**serialize_product(product), 'description': product.description})
@@ -0,0 +1,21 @@
+from django.core.cache import cache
+
+
+def get_version(key, initial=1):
+    """
+    Счетчик в общем кэше. Если ключа нет (первый запуск или вытеснение), он создается
+    со значением initial через cache.add, поэтому одновременные процессы получат одно значение.
+    """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, initial, None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(key, initial=1):
+    """Увеличение счетчика; возвращает новое значение."""
+    try:
+        return cache.incr(key)
+    except ValueError:
+        return get_version(key, initial)
@@ -1,5 +1,5 @@
-from django.conf import settings
-from .models import Product
+from .models import Product, Size
+from .cart_storage import decode_cart, encode_cart, get_cart_storage
 from decimal import Decimal
 from django.contrib import messages
 from django.shortcuts import get_object_or_404
@@ -8,11 +8,9 @@ from django.shortcuts import get_object_or_404
 class CartSession(object):
     def __init__(self, request):
         self.request = request
-        self.session = request.session
-        cart = self.session.get(settings.CART_SESSION_ID)
-        if not cart:
-            cart = self.session[settings.CART_SESSION_ID] = {}
-        self.cart = cart
+        self.storage = get_cart_storage(request)
+        self.cart, self._totals = decode_cart(self.storage.load())
+        self._items = None
 
     def add(self, product, size=None, quantity=1):
         """
@@ -71,10 +69,10 @@ class CartSession(object):
                 self.save()
 
     def save(self):
-        # Обновление сессии cart
-        self.session[settings.CART_SESSION_ID] = self.cart
-        # Отметить сеанс как "измененный", чтобы убедиться, что он сохранен
-        self.session.modified = True
+        # Запись корзины в хранилище (CART_STORAGE)
+        self.storage.save(encode_cart(self.cart))
+        self._items = None
+        self._totals = None
 
     def remove(self, id):
         product_id = str(id)
@@ -82,65 +80,107 @@ class CartSession(object):
             del self.cart[product_id]
             self.save()
 
+    def hydrate(self):
+        """
+        Загрузка товаров и размеров корзины: один запрос товаров и один запрос размеров.
+        """
+        if self._items is not None:
+            return self._items
+        lines = []
+        sizes_filter = set()
+        for key, item in self.cart.items():
+            product_id = int(str(key).split('-')[0])
+            lines.append((product_id, item))
+            if item.get('size'):
+                sizes_filter.add(item['size'])
+        products = Product.objects.in_bulk({product_id for product_id, item in lines})
+        sizes = {}
+        if sizes_filter:
+            sized_ids = {product_id for product_id, item in lines if item.get('size')}
+            for size in Size.objects.filter(product_id__in=sized_ids, size__in=sizes_filter):
+                sizes[(size.product_id, str(size.size.normalize()))] = size
+
+        items = []
+        for product_id, item in lines:
+            product = products.get(product_id)
+            if product is None:
+                continue
+            price = Decimal(item['price'])
+            hydrated = dict(item, product=product, price=price, final_price=price * item['qty'])
+            if item.get('size'):
+                hydrated['size_obj'] = sizes.get((product_id, item['size']))
+            items.append(hydrated)
+        self._items = items
+        return items
+
     def __iter__(self):
         """
-        Перебор элементов в корзине и получение продуктов из базы данных.
+        Перебор элементов в корзине с товарами из базы данных.
         """
-        product_ids = self.cart.keys()
-        # получение объектов product и добавление их в корзину
-        products = Product.objects.filter(id__in=list(map(lambda x: str(x).split('-')[0], product_ids)))
-
-        for product_id in product_ids:
-            for product in products:
-                if product_id.split('-')[0] == str(product.id):
-                    self.cart[product_id]['product'] = product
-                    if self.cart[product_id].get('size'):
-                        self.cart[product_id]['size_obj'] = product.size_set.filter(size=self.cart[product_id]['size'])[
-                            0]
-        for item in self.cart.values():
-            item['price'] = Decimal(item['price'])
-            item['final_price'] = item['price'] * item['qty']
-            yield item
+        return iter(self.hydrate())
+
+    def _get_totals(self):
+        if self._totals is None:
+            items = self._items if self._items is not None else self.cart.values()
+            self._totals = (sum(item['qty'] for item in items),
+                            sum(Decimal(item['price']) * item['qty'] for item in items))
+        return self._totals
 
     def get_total_items(self):
         """
         Подсчет всех товаров в корзине.
         """
-        return sum(item['qty'] for item in self.cart.values())
+        return self._get_totals()[0]
 
     def get_total_price(self):
         """
         Подсчет стоимости товаров в корзине.
         """
-        return sum(Decimal(item['price']) * item['qty'] for item in self.cart.values())
+        return self._get_totals()[1]
 
     def clear(self):
-        # удаление корзины из сессии
-        del self.session[settings.CART_SESSION_ID]
-        self.session.modified = True
+        # удаление корзины из хранилища
+        self.storage.clear()
+        self.cart = {}
+        self._items = None
+        self._totals = None
 
 
 class CartUserView(object):
+    """
+    Корзина пользователя для отображения: итоги из строки Cart,
+    строки с товарами и размерами загружаются одним запросом при первом переборе.
+    """
+
     def __init__(self, cart):
+        self.cart = cart
         self.final_price = cart.final_price
-        self.cart_dict = {}
-        for item in cart.cartproduct_set.all():
-            self.cart_dict[str(item.id)] = {
-                'id': str(item.id),
-                'qty': item.qty,
-                'final_price': item.final_price
-            }
-            if item.size is not None:
-                self.cart_dict[str(item.id)]['size_obj'] = item.size
-                self.cart_dict[str(item.id)]['size'] = item.size.size
-            self.cart_dict[str(item.id)]['product'] = item.product
+        self._items = None
+
+    def hydrate(self):
+        if self._items is None:
+            items, lines = [], []
+            if self.cart.pk is not None:
+                lines = self.cart.cartproduct_set.select_related('product', 'size').order_by('id')
+            for item in lines:
+                line = {
+                    'id': str(item.id),
+                    'qty': item.qty,
+                    'final_price': item.final_price,
+                    'product': item.product
+                }
+                if item.size is not None:
+                    line['size_obj'] = item.size
+                    line['size'] = item.size.size
+                items.append(line)
+            self._items = items
+        return self._items
 
     def __iter__(self):
-        for item in self.cart_dict.values():
-            yield item
+        return iter(self.hydrate())
 
     def get_total_items(self):
-        return sum(item['qty'] for item in self.cart_dict.values())
+        return self.cart.total_product
 
     def get_total_price(self):
         return self.final_price
@@ -0,0 +1,199 @@
+import uuid
+from decimal import Decimal
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+CART_PAYLOAD_VERSION = 1
+CART_COOKIE_SALT = 'shop.cart'
+
+
+def encode_cart(cart):
+    """
+    Компактная запись корзины: {'v': версия, 'l': [[id товара, размер, кол-во, цена в копейках]],
+    'q': всего товаров, 'c': сумма в копейках}.
+    """
+    lines, total_qty, total_cents = [], 0, 0
+    for key, item in cart.items():
+        cents = int(Decimal(item['price']) * 100)
+        lines.append([int(str(key).split('-')[0]), item.get('size', ''), item['qty'], cents])
+        total_qty += item['qty']
+        total_cents += cents * item['qty']
+    return {'v': CART_PAYLOAD_VERSION, 'l': lines, 'q': total_qty, 'c': total_cents}
+
+
+def decode_cart(payload):
+    """
+    Корзина в виде {ключ: строка} и итоги (количество, сумма) или None, если итогов нет.
+    Понимает и старый формат сессии (словарь строк без версии).
+    """
+    if not payload:
+        return {}, None
+    if payload.get('v') != CART_PAYLOAD_VERSION:
+        return dict(payload), None
+    cart = {}
+    for product_id, size, qty, cents in payload['l']:
+        key = '{0}-{1}'.format(product_id, size) if size else str(product_id)
+        cart[key] = {'id': key, 'qty': qty, 'price': str(Decimal(cents).scaleb(-2))}
+        if size:
+            cart[key]['size'] = size
+    return cart, (payload['q'], Decimal(payload['c']).scaleb(-2))
+
+
+class CartStorage(object):
+    """
+    Хранилище корзины анонимного посетителя. Запись выполняется один раз, cookie (если нужны)
+    выставляются CartStorageMiddleware в ответе.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self._payload = None
+        self._loaded = False
+
+    def load(self):
+        if not self._loaded:
+            self._payload = self._load()
+            self._loaded = True
+        return self._payload
+
+    def save(self, payload):
+        self._payload, self._loaded = payload, True
+        self._save(payload)
+
+    def clear(self):
+        self._payload, self._loaded = None, True
+        self._clear()
+
+    def update(self, response):
+        pass
+
+    def _load(self):
+        raise NotImplementedError
+
+    def _save(self, payload):
+        raise NotImplementedError
+
+    def _clear(self):
+        raise NotImplementedError
+
+
+class SessionCartStorage(CartStorage):
+    """Корзина в сессии (с бэкендом сессий в БД - в базе данных)"""
+
+    def _load(self):
+        return self.request.session.get(settings.CART_SESSION_ID)
+
+    def _save(self, payload):
+        self.request.session[settings.CART_SESSION_ID] = payload
+
+    def _clear(self):
+        self.request.session.pop(settings.CART_SESSION_ID, None)
+
+
+class SignedCookieMixin(object):
+    """
+    Значение для подписанной cookie корзины: None - не менять, '' - удалить.
+    in_session - найдена ли корзина в сессии (None - неизвестно): сессия меняется, только если
+    корзина действительно в ней лежит, иначе каждое изменение корзины было бы записью сессии в БД.
+    """
+    cookie = None
+    in_session = None
+
+    def read_cookie(self):
+        value = self.request.COOKIES.get(settings.CART_COOKIE_NAME)
+        if value:
+            try:
+                return signing.loads(value, salt=CART_COOKIE_SALT, max_age=settings.CART_COOKIE_AGE)
+            except signing.BadSignature:
+                pass
+        return None
+
+    def load_session(self):
+        payload = super()._load()
+        self.in_session = payload is not None
+        return payload
+
+    def clear_session(self):
+        if self.in_session is not False:
+            super()._clear()
+            self.in_session = False
+
+    def update(self, response):
+        if self.cookie is None:
+            return
+        if self.cookie:
+            response.set_cookie(settings.CART_COOKIE_NAME, self.cookie, max_age=settings.CART_COOKIE_AGE,
+                                secure=settings.SESSION_COOKIE_SECURE, httponly=True, samesite='Lax')
+        elif settings.CART_COOKIE_NAME in self.request.COOKIES:
+            response.delete_cookie(settings.CART_COOKIE_NAME)
+
+
+class CookieCartStorage(SignedCookieMixin, SessionCartStorage):
+    """
+    Корзина в подписанной cookie. Если корзина не помещается в CART_COOKIE_MAX_SIZE,
+    она сохраняется в сессии, как и корзины, созданные до перехода на cookie.
+    """
+
+    def _load(self):
+        payload = self.read_cookie()
+        if payload is not None:
+            self.in_session = False
+            return payload
+        return self.load_session()
+
+    def _save(self, payload):
+        value = signing.dumps(payload, salt=CART_COOKIE_SALT, compress=True)
+        if len(value) > settings.CART_COOKIE_MAX_SIZE:
+            super()._save(payload)
+            self.in_session = True
+            value = ''
+        else:
+            self.clear_session()
+        self.cookie = value
+
+    def _clear(self):
+        self.clear_session()
+        self.cookie = ''
+
+
+class CacheCartStorage(SignedCookieMixin, SessionCartStorage):
+    """Корзина в кэше, в подписанной cookie - только ее идентификатор"""
+
+    def get_cache_key(self, cart_id):
+        return 'shop:cart:{0}'.format(cart_id)
+
+    def _load(self):
+        cart_id = self.read_cookie()
+        if cart_id is None:
+            return self.load_session()
+        self.in_session = False
+        return cache.get(self.get_cache_key(cart_id))
+
+    def _save(self, payload):
+        cart_id = self.read_cookie() or uuid.uuid4().hex
+        cache.set(self.get_cache_key(cart_id), payload, settings.CART_COOKIE_AGE)
+        self.clear_session()
+        self.cookie = signing.dumps(cart_id, salt=CART_COOKIE_SALT)
+
+    def _clear(self):
+        cart_id = self.read_cookie()
+        if cart_id is not None:
+            cache.delete(self.get_cache_key(cart_id))
+        self.clear_session()
+        self.cookie = ''
+
+
+def get_cart_storage(request):
+    """
+    Хранилище корзины текущего запроса (CART_STORAGE), одно на запрос.
+    """
+    if not hasattr(request, 'cart_storage'):
+        request.cart_storage = import_string(settings.CART_STORAGE)(request)
+    return request.cart_storage
+
+
+def has_cart_items(request):
+    return bool(decode_cart(get_cart_storage(request).load())[0])
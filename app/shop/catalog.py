@@ -0,0 +1,200 @@
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Category, Product, Size, get_path_category
+from .recalc import recalc_products, reprice_open_carts
+from .search import search_backend
+from .services import bump_catalog_version, clear_category_cache
+from .suggest import suggest_index
+
+FIELDS = ['type', 'slug', 'name', 'category', 'description', 'price', 'qty', 'image', 'product', 'size']
+
+TYPE_CATEGORY = 'category'
+TYPE_PRODUCT = 'product'
+TYPE_SIZE = 'size'
+
+
+class CatalogError(Exception):
+    pass
+
+
+def iter_catalog(chunk_size=2000):
+    """
+    Строки каталога: сначала категории, затем товары, затем размеры.
+    """
+    for category in Category.objects.order_by('id').iterator(chunk_size=chunk_size):
+        yield {'type': TYPE_CATEGORY, 'slug': category.slug, 'name': category.name}
+    for product in Product.objects.select_related('category').order_by('id').iterator(chunk_size=chunk_size):
+        yield {'type': TYPE_PRODUCT, 'slug': product.slug, 'name': product.name, 'category': product.category.slug,
+               'description': product.description, 'price': str(product.price), 'qty': product.qty,
+               'image': product.image.name}
+    sizes = Size.objects.order_by('id').values_list('product__slug', 'size', 'qty')
+    for product_slug, size, qty in sizes.iterator(chunk_size=chunk_size):
+        yield {'type': TYPE_SIZE, 'product': product_slug, 'size': str(size.normalize()), 'qty': qty}
+
+
+def write_catalog(stream, file_format, chunk_size=2000):
+    count = 0
+    if file_format == 'csv':
+        writer = csv.DictWriter(stream, fieldnames=FIELDS)
+        writer.writeheader()
+        for count, row in enumerate(iter_catalog(chunk_size), 1):
+            writer.writerow(row)
+    else:
+        for count, row in enumerate(iter_catalog(chunk_size), 1):
+            stream.write(json.dumps(row, ensure_ascii=False) + '\n')
+    return count
+
+
+def read_catalog(stream, file_format):
+    if file_format == 'csv':
+        for row in csv.DictReader(stream):
+            yield row
+    else:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+def parse_decimal(value, line):
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        raise CatalogError('Строка {0}: неверное число "{1}"'.format(line, value))
+
+
+def parse_int(value, line):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise CatalogError('Строка {0}: неверное количество "{1}"'.format(line, value))
+
+
+class CatalogImporter(object):
+    """
+    Потоковый импорт каталога: строки копятся пачками по chunk_size и записываются
+    bulk_create/bulk_update по slug (размеры - по товару и размеру). Сигналы не вызываются,
+    остатки и корзины пересчитываются пачками, индексы и кэши - один раз в конце.
+    """
+
+    def __init__(self, chunk_size=1000):
+        self.chunk_size = chunk_size
+        self.buffers = {TYPE_CATEGORY: [], TYPE_PRODUCT: [], TYPE_SIZE: []}
+        self.category_ids = {}
+        self.stats = {'created': 0, 'updated': 0}
+
+    def run(self, rows):
+        try:
+            for line, row in enumerate(rows, 1):
+                row_type = row.get('type')
+                if row_type not in self.buffers:
+                    raise CatalogError('Строка {0}: неизвестный тип "{1}"'.format(line, row_type))
+                self.buffers[row_type].append((line, row))
+                if len(self.buffers[row_type]) >= self.chunk_size:
+                    self.flush(row_type)
+            for row_type in (TYPE_CATEGORY, TYPE_PRODUCT, TYPE_SIZE):
+                self.flush(row_type)
+        finally:
+            if self.stats['created'] or self.stats['updated']:
+                self.finish()
+        return self.stats
+
+    def flush(self, row_type):
+        rows, self.buffers[row_type] = self.buffers[row_type], []
+        if not rows:
+            return
+        if row_type != TYPE_CATEGORY:
+            self.flush(TYPE_CATEGORY)
+        if row_type == TYPE_SIZE:
+            self.flush(TYPE_PRODUCT)
+        handlers = {TYPE_CATEGORY: self.import_categories, TYPE_PRODUCT: self.import_products,
+                    TYPE_SIZE: self.import_sizes}
+        with transaction.atomic():
+            handlers[row_type](rows)
+
+    def save(self, model, objects, fields):
+        created = [obj for obj in objects if obj.pk is None]
+        updated = [obj for obj in objects if obj.pk is not None]
+        model.objects.bulk_create(created, batch_size=self.chunk_size)
+        model.objects.bulk_update(updated, fields, batch_size=self.chunk_size)
+        self.stats['created'] += len(created)
+        self.stats['updated'] += len(updated)
+
+    def import_categories(self, rows):
+        rows = dict((row['slug'], row) for line, row in rows)
+        categories = Category.objects.in_bulk(list(rows), field_name='slug')
+        objects = []
+        for slug, row in rows.items():
+            category = categories.get(slug) or Category(slug=slug)
+            category.name = row['name']
+            category.updated_at = timezone.now()
+            objects.append(category)
+        self.save(Category, objects, ['name', 'updated_at'])
+        for category in Category.objects.filter(slug__in=list(rows)).only('id', 'slug'):
+            self.category_ids[category.slug] = category
+
+    def get_category(self, slug, line):
+        if slug not in self.category_ids:
+            category = Category.objects.filter(slug=slug).first()
+            if category is None:
+                raise CatalogError('Строка {0}: нет категории "{1}"'.format(line, slug))
+            self.category_ids[slug] = category
+        return self.category_ids[slug]
+
+    def import_products(self, rows):
+        rows = dict((row['slug'], (line, row)) for line, row in rows)
+        products = Product.objects.in_bulk(list(rows), field_name='slug')
+        objects, repriced = [], []
+        for slug, (line, row) in rows.items():
+            product = products.get(slug) or Product(slug=slug)
+            price = parse_decimal(row['price'], line)
+            if product.pk is not None and product.price != price:
+                repriced.append(product.pk)
+            product.name = row['name']
+            product.category = self.get_category(row['category'], line)
+            product.description = row.get('description') or ''
+            product.price = price
+            product.qty = parse_int(row.get('qty') or 0, line)
+            image = row.get('image')
+            if image or not product.image:
+                image_name = get_path_category(product, Path(image or slug + '.png').name)
+                if product.image.name != image_name:
+                    product.image = image_name
+                    product.image_widths = ''
+            product.updated_at = timezone.now()
+            objects.append(product)
+        self.save(Product, objects, ['name', 'category', 'description', 'price', 'qty', 'image', 'image_widths',
+                                    'updated_at'])
+        if repriced:
+            reprice_open_carts(repriced)
+
+    def import_sizes(self, rows):
+        products = Product.objects.in_bulk({row['product'] for line, row in rows}, field_name='slug')
+        parsed = {}
+        for line, row in rows:
+            product = products.get(row['product'])
+            if product is None:
+                raise CatalogError('Строка {0}: нет товара "{1}"'.format(line, row['product']))
+            size = parse_decimal(row['size'], line)
+            parsed[(product.id, size)] = parse_int(row['qty'], line)
+        product_ids = {product_id for product_id, size in parsed}
+        existing = {(size.product_id, size.size): size
+                    for size in Size.objects.filter(product_id__in=product_ids)}
+        objects = []
+        for (product_id, size_value), qty in parsed.items():
+            size = existing.get((product_id, size_value)) or Size(product_id=product_id, size=size_value)
+            size.qty = qty
+            objects.append(size)
+        self.save(Size, objects, ['qty'])
+        recalc_products(product_ids)
+
+    def finish(self):
+        search_backend.rebuild()
+        clear_category_cache()
+        bump_catalog_version()
+        suggest_index.bump_shared_version()
@@ -0,0 +1,6 @@
+from django.utils.functional import SimpleLazyObject
+from .services import get_category
+
+
+def categories(request):
+    return {'categories': SimpleLazyObject(get_category)}
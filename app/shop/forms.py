@@ -8,3 +8,24 @@ class OrderForm(forms.ModelForm):
         fields = (
             'first_name', 'last_name', 'phone', 'address', 'buying_type', 'payment_type', 'comment'
         )
+
+
+class ChangePriceForm(forms.Form):
+    MODE_SET = 'set'
+    MODE_PERCENT = 'percent'
+
+    MODE_CHOICES = (
+        (MODE_SET, 'Установить цену'),
+        (MODE_PERCENT, 'Изменить на процент')
+    )
+
+    mode = forms.ChoiceField(choices=MODE_CHOICES, label='Способ')
+    value = forms.DecimalField(max_digits=9, decimal_places=2, label='Значение')
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('mode') == self.MODE_SET and cleaned_data.get('value', 0) < 0:
+            raise forms.ValidationError('Цена не может быть отрицательной')
+        if cleaned_data.get('mode') == self.MODE_PERCENT and cleaned_data.get('value', 0) <= -100:
+            raise forms.ValidationError('Нельзя уменьшить цену на 100% и более')
+        return cleaned_data
@@ -0,0 +1,90 @@
+from io import BytesIO
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image
+
+FALLBACK_FORMATS = {'.jpg': 'JPEG', '.jpeg': 'JPEG', '.png': 'PNG'}
+
+
+def get_fallback_suffix(name):
+    suffix = PurePosixPath(name).suffix.lower()
+    return suffix if suffix in FALLBACK_FORMATS else '.jpg'
+
+
+def get_derivative_name(name, width, suffix):
+    """
+    Имя уменьшенной копии рядом с оригиналом: rings/ring.png -> rings/ring-400w.webp
+    """
+    path = PurePosixPath(name)
+    return str(path.with_name('{0}-{1}w{2}'.format(path.stem, width, suffix)))
+
+
+def get_derivative_names(name):
+    suffixes = ('.webp', get_fallback_suffix(name))
+    return [get_derivative_name(name, width, suffix)
+            for width in settings.PRODUCT_IMAGE_WIDTHS for suffix in suffixes]
+
+
+def parse_widths(value):
+    return [int(width) for width in value.split(',') if width] if value else []
+
+
+def format_widths(widths):
+    return ','.join(map(str, widths))
+
+
+def get_srcset(name, suffix, widths):
+    return ', '.join('{0} {1}w'.format(default_storage.url(get_derivative_name(name, width, suffix)), width)
+                     for width in widths)
+
+
+def encode(image, file_format):
+    if file_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    options = {'quality': settings.PRODUCT_IMAGE_QUALITY} if file_format in ('JPEG', 'WEBP') else {'optimize': True}
+    image.save(buffer, file_format, **options)
+    return buffer.getvalue()
+
+
+def generate_derivatives(name, force=False):
+    """
+    Копии изображения шириной PRODUCT_IMAGE_WIDTHS в WebP и в формате оригинала. Ширины больше
+    оригинала пропускаются. Возвращает список ширин, для которых копии есть; пустой список -
+    оригинала нет или он не читается.
+    """
+    if not name or not default_storage.exists(name):
+        return []
+    suffix = get_fallback_suffix(name)
+    try:
+        with default_storage.open(name) as file:
+            with Image.open(file) as original:
+                widths = [width for width in settings.PRODUCT_IMAGE_WIDTHS if width <= original.width]
+                names = [get_derivative_name(name, width, derivative_suffix)
+                         for width in widths for derivative_suffix in ('.webp', suffix)]
+                if not force and all(default_storage.exists(derivative) for derivative in names):
+                    return widths
+                original.load()
+                for width in widths:
+                    image = original.copy()
+                    image.thumbnail((width, width * 10), Image.LANCZOS)
+                    for derivative_suffix, file_format in (('.webp', 'WEBP'),
+                                                           (suffix, FALLBACK_FORMATS.get(suffix, 'JPEG'))):
+                        derivative = get_derivative_name(name, width, derivative_suffix)
+                        if default_storage.exists(derivative):
+                            default_storage.delete(derivative)
+                        default_storage.save(derivative, ContentFile(encode(image, file_format)))
+    except OSError:
+        return []
+    return widths
+
+
+def delete_derivatives(name):
+    if not name:
+        return
+    for derivative in get_derivative_names(name):
+        if default_storage.exists(derivative):
+            default_storage.delete(derivative)
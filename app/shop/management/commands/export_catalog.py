@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from shop.catalog import write_catalog
+
+
+class Command(BaseCommand):
+    help = 'Выгрузка каталога (категории, товары, размеры) в CSV или JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv', help='Формат файла')
+        parser.add_argument('--output', help='Файл (по умолчанию - stdout)')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Строк за один запрос к БД')
+
+    def handle(self, *args, **options):
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as stream:
+                count = write_catalog(stream, options['format'], options['chunk_size'])
+            self.stderr.write('Выгружено строк: {0}'.format(count))
+        else:
+            write_catalog(self.stdout, options['format'], options['chunk_size'])
@@ -0,0 +1,29 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from shop.models import Order
+from shop.order_export import filter_orders, stream_orders
+
+
+class Command(BaseCommand):
+    help = 'Выгрузка заказов с позициями в CSV или JSONL для бухгалтерии'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv', help='Формат файла')
+        parser.add_argument('--output', help='Файл (по умолчанию - stdout)')
+        parser.add_argument('--date-from', type=date.fromisoformat, help='С даты создания (ГГГГ-ММ-ДД)')
+        parser.add_argument('--date-to', type=date.fromisoformat, help='По дату создания включительно (ГГГГ-ММ-ДД)')
+        parser.add_argument('--status', action='append', choices=[status for status, name in Order.STATUS_CHOICES],
+                            help='Статус заказа (можно указать несколько раз)')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Заказов за один запрос к БД')
+
+    def handle(self, *args, **options):
+        orders = filter_orders(date_from=options['date_from'], date_to=options['date_to'],
+                               statuses=options['status'])
+        chunks = stream_orders(orders, options['format'], options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as stream:
+                stream.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
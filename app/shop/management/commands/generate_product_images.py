@@ -0,0 +1,29 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from shop.images import format_widths, generate_derivatives
+from shop.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Создание уменьшенных копий (WebP и запасной формат) для изображений товаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Количество процессов')
+        parser.add_argument('--force', action='store_true', help='Пересоздать существующие копии')
+
+    def handle(self, *args, **options):
+        names = list(Product.objects.exclude(image='').values_list('image', flat=True).distinct())
+        generate = partial(generate_derivatives, force=options['force'])
+        if options['workers'] > 1:
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+                widths = list(pool.map(generate, names, chunksize=16))
+        else:
+            widths = list(map(generate, names))
+        for name, image_widths in zip(names, widths):
+            Product.objects.filter(image=name).update(image_widths=format_widths(image_widths))
+        ready = sum(1 for image_widths in widths if image_widths)
+        self.stdout.write(self.style.SUCCESS('Изображений: {0}, с копиями: {1}'.format(len(names), ready)))
@@ -0,0 +1,23 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from shop.catalog import CatalogError, CatalogImporter, read_catalog
+
+
+class Command(BaseCommand):
+    help = 'Загрузка каталога из CSV или JSONL (обновление по slug)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл каталога')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Формат файла (по расширению)')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Строк в одной пачке')
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or ('jsonl' if Path(options['path']).suffix == '.jsonl' else 'csv')
+        importer = CatalogImporter(chunk_size=options['chunk_size'])
+        try:
+            with open(options['path'], encoding='utf-8', newline='') as stream:
+                stats = importer.run(read_catalog(stream, file_format))
+        except (CatalogError, ValueError, KeyError) as error:
+            raise CommandError(error)
+        self.stdout.write('Создано: {0}, обновлено: {1}'.format(stats['created'], stats['updated']))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from shop.analytics import rebuild_daily_sales
+
+
+class Command(BaseCommand):
+    help = 'Пересчет продаж по дням по всем заказам (запускать при остановленном приеме заказов)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Заказов в одной пачке')
+
+    def handle(self, *args, **options):
+        total = rebuild_daily_sales(chunk_size=options['chunk_size'])
+        self.stdout.write('Заказов учтено: {0}'.format(total))
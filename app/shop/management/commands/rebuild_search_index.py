@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from shop.search import search_backend
+from shop.services import bump_catalog_version
+
+
+class Command(BaseCommand):
+    help = 'Перестроение поискового индекса товаров'
+
+    def handle(self, *args, **options):
+        search_backend.rebuild()
+        bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS('Поисковый индекс перестроен'))
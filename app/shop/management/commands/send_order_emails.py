@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+from shop.outbox import send_pending
+
+
+class Command(BaseCommand):
+    help = 'Отправка писем о заказах из очереди'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Количество потоков отправки')
+        parser.add_argument('--batch', type=int, default=100, help='Писем за один проход')
+        parser.add_argument('--loop', action='store_true', help='Работать постоянно')
+        parser.add_argument('--interval', type=float, default=5, help='Пауза между проходами (секунды)')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = send_pending(workers=options['workers'], batch=options['batch'])
+            if sent or failed:
+                self.stdout.write('Отправлено: {0}, ошибок: {1}'.format(sent, failed))
+            if not options['loop']:
+                break
+            if sent + failed < options['batch']:
+                time.sleep(options['interval'])
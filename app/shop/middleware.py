@@ -0,0 +1,29 @@
+from .recalc import defer_recalc
+
+
+class RecalcMiddleware(object):
+    """
+    Пересчет итогов корзин и остатков товаров один раз в конце запроса.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with defer_recalc():
+            return self.get_response(request)
+
+
+class CartStorageMiddleware(object):
+    """
+    Запись cookie корзины анонимного посетителя, если корзина изменилась за время запроса.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if hasattr(request, 'cart_storage'):
+            request.cart_storage.update(response)
+        return response
@@ -0,0 +1,30 @@
+from django.db import migrations
+
+
+def create_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        'CREATE VIRTUAL TABLE IF NOT EXISTS shop_product_fts USING fts5('
+        'name, description, category, tokenize = "unicode61 remove_diacritics 2", prefix = "3 4")')
+    schema_editor.execute(
+        'INSERT INTO shop_product_fts (rowid, name, description, category) '
+        'SELECT p.id, p.name, p.description, c.name FROM shop_product p '
+        'INNER JOIN shop_category c ON c.id = p.category_id')
+
+
+def drop_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS shop_product_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0003_size_qty'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts, drop_fts),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.1.3 on 2026-10-18 15:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0006_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['customer', 'in_order'], name='shop_cart_customer_open_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cartproduct',
+            index=models.Index(fields=['cart', 'product', 'size'], name='shop_cartproduct_line_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['customer', 'status'], name='shop_order_customer_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='size',
+            index=models.Index(fields=['product', 'size'], name='shop_size_product_size_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.1.3 on 2026-10-18 15:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0007_hot_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySales',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('size', models.DecimalField(decimal_places=1, default=0, max_digits=9, verbose_name='Размер')),
+                ('buying_type', models.CharField(choices=[('courier', 'Курьер в городе Молодечно (бесплатно)'), ('delivery', 'Доставка почтой, оплата при получении (стоимость 3-5 руб, от 40 руб. бесплатно)'), ('delivery_cart', 'Доставка почтой, предоплата (стоимость 3 РУБ, от 40 руб бесплатно)')], max_length=100, verbose_name='Тип доставки')),
+                ('orders', models.IntegerField(default=0, verbose_name='Заказов')),
+                ('units', models.IntegerField(default=0, verbose_name='Продано единиц')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Выручка')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='shop.category', verbose_name='Категория')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='shop.product', verbose_name='Товар')),
+            ],
+            options={
+                'verbose_name': 'Продажи за день',
+                'verbose_name_plural': 'Продажи по дням',
+                'ordering': ['-date', 'product_id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='dailysales',
+            index=models.Index(fields=['date', 'category'], name='shop_dailysales_category_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailysales',
+            constraint=models.UniqueConstraint(fields=('date', 'product', 'size', 'buying_type'), name='shop_dailysales_key'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.3 on 2026-10-18 16:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0009_order_created_at_auto_now_add'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='image_widths',
+            field=models.CharField(blank=True, editable=False, max_length=100, verbose_name='Ширины копий изображения'),
+        ),
+    ]
@@ -5,12 +5,16 @@ from django.shortcuts import reverse
 from django.core.validators import MinValueValidator
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
+from django.utils import timezone
+from .recalc import reprice_open_carts
+from .images import generate_derivatives, delete_derivatives, format_widths
 
 
 class Category(models.Model):
     """Категория"""
     name = models.CharField('Наименование категории', max_length=255)
     slug = models.SlugField(unique=True)
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
 
     class Meta:
         verbose_name = 'Категория'
@@ -40,6 +44,8 @@ class Product(models.Model):
     image = models.ImageField('Изображение', upload_to=get_path_category)
     qty = models.PositiveIntegerField(verbose_name='Количество')
     price = models.DecimalField(validators=[MinValueValidator(0)], max_digits=9, decimal_places=2, verbose_name='Цена')
+    image_widths = models.CharField('Ширины копий изображения', max_length=100, blank=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
 
     def get_tags_meta(self):
         return [self.slug, self.name, self.category.name]
@@ -52,11 +58,27 @@ class Product(models.Model):
     def get_absolute_url(self):
         return reverse('product_detail', args=[self.category.slug, self.slug])
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_price = instance.__dict__.get('price')
+        instance._loaded_image = instance.__dict__.get('image')
+        return instance
+
     def save(self, *args, **kwargs):
-        for item in self.cartproduct_set.all():
-            if not item.cart.in_order:
-                item.save()
+        price_changed = not self._state.adding and self.price != getattr(self, '_loaded_price', None)
+        loaded_image = getattr(self, '_loaded_image', None)
+        image_changed = 'image' in self.__dict__ and self.image.name != loaded_image
         super().save(*args, **kwargs)
+        self._loaded_price = self.price
+        if price_changed:
+            reprice_open_carts([self.id])
+        if image_changed:
+            self._loaded_image = self.image.name
+            if loaded_image:
+                delete_derivatives(loaded_image)
+            self.image_widths = format_widths(generate_derivatives(self.image.name, force=True))
+            Product.objects.filter(pk=self.pk).update(image_widths=self.image_widths)
 
     def __str__(self):
         return self.name
@@ -74,6 +96,7 @@ class CartProduct(models.Model):
     class Meta:
         verbose_name = 'Корзина продукта'
         verbose_name_plural = 'Корзины продуктов'
+        indexes = [models.Index(fields=['cart', 'product', 'size'], name='shop_cartproduct_line_idx')]
 
     def save(self, *args, **kwargs):
         self.final_price = self.qty * self.product.price
@@ -93,6 +116,7 @@ class Cart(models.Model):
     class Meta:
         verbose_name = 'Корзина'
         verbose_name_plural = 'Корзины'
+        indexes = [models.Index(fields=['customer', 'in_order'], name='shop_cart_customer_open_idx')]
 
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
@@ -162,12 +186,30 @@ class Order(models.Model):
         default=PAYMENT_TYPE_CASH
     )
     comment = models.TextField(verbose_name='Комментарий к заказу', null=True, blank=True)
-    created_at = models.DateTimeField(auto_now=True, verbose_name='Дата создания заказа')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания заказа')
 
     class Meta:
         verbose_name = 'Заказ'
         verbose_name_plural = 'Заказы'
         ordering = ['-id']
+        indexes = [models.Index(fields=['customer', 'status'], name='shop_order_customer_status_idx')]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if not instance.get_deferred_fields() & {'status', 'created_at', 'buying_type'}:
+            instance._loaded_sale = (instance.status, instance.created_at, instance.buying_type)
+        return instance
+
+    def save(self, *args, **kwargs):
+        from .analytics import get_sale_state, update_order_sales
+        previous = getattr(self, '_loaded_sale', None)
+        if previous is None and not self._state.adding:
+            previous = Order.objects.filter(pk=self.pk).values_list('status', 'created_at', 'buying_type').first()
+        super().save(*args, **kwargs)
+        self._loaded_sale = get_sale_state(self)
+        if previous != self._loaded_sale:
+            update_order_sales(self, previous, self._loaded_sale)
 
     def delete(self, *args, **kwargs):
         super(Order, self).delete()
@@ -188,8 +230,63 @@ class Size(models.Model):
         verbose_name = 'Размер'
         verbose_name_plural = 'Размеры'
         ordering = ['product__name']
+        indexes = [models.Index(fields=['product', 'size'], name='shop_size_product_size_idx')]
 
     def __str__(self):
         return '{0} | {1}'.format(self.product.name, self.size)
 
 
+class EmailOutbox(models.Model):
+    """Письмо о заказе к отправке"""
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Ожидает отправки'),
+        (STATUS_SENDING, 'Отправляется'),
+        (STATUS_SENT, 'Отправлено'),
+        (STATUS_FAILED, 'Ошибка отправки')
+    )
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, verbose_name='Заказ')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING, verbose_name='Статус')
+    attempts = models.PositiveIntegerField(default=0, verbose_name='Попытки')
+    available_at = models.DateTimeField(default=timezone.now, verbose_name='Отправить после')
+    locked_at = models.DateTimeField(null=True, blank=True, verbose_name='Взято в работу')
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name='Отправлено')
+    last_error = models.TextField(blank=True, verbose_name='Последняя ошибка')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создано')
+
+    class Meta:
+        verbose_name = 'Письмо о заказе'
+        verbose_name_plural = 'Письма о заказах'
+        ordering = ['id']
+        indexes = [models.Index(fields=['status', 'available_at'])]
+
+    def __str__(self):
+        return 'Письмо({0}): заказ {1}'.format(self.id, self.order_id)
+
+
+class DailySales(models.Model):
+    """Продажи за день: товар, размер и тип доставки (без отмененных заказов)"""
+    date = models.DateField(verbose_name='Дата')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, verbose_name='Категория')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, verbose_name='Товар')
+    size = models.DecimalField(verbose_name='Размер', max_digits=9, decimal_places=1, default=0)
+    buying_type = models.CharField(max_length=100, choices=Order.BUYING_TYPE_CHOICES, verbose_name='Тип доставки')
+    orders = models.IntegerField(default=0, verbose_name='Заказов')
+    units = models.IntegerField(default=0, verbose_name='Продано единиц')
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name='Выручка')
+
+    class Meta:
+        verbose_name = 'Продажи за день'
+        verbose_name_plural = 'Продажи по дням'
+        ordering = ['-date', 'product_id']
+        constraints = [models.UniqueConstraint(fields=['date', 'product', 'size', 'buying_type'],
+                                               name='shop_dailysales_key')]
+        indexes = [models.Index(fields=['date', 'category'], name='shop_dailysales_category_idx')]
+
+    def __str__(self):
+        return '{0} | {1}'.format(self.date, self.product_id)
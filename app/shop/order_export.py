@@ -0,0 +1,95 @@
+import csv
+import json
+from itertools import islice
+
+from django.utils import timezone
+
+from .models import CartProduct, Order
+
+ORDER_FIELDS = ['id', 'created_at', 'status', 'buying_type', 'payment_type', 'customer', 'first_name',
+                'last_name', 'phone', 'address', 'comment', 'total_product', 'final_price']
+LINE_FIELDS = ['product', 'size', 'qty', 'line_price']
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+ORDER_LOOKUPS = ['id', 'created_at', 'status', 'buying_type', 'payment_type', 'customer__username', 'first_name',
+                 'last_name', 'phone', 'address', 'comment', 'cart__total_product', 'cart__final_price', 'cart_id']
+
+
+def filter_orders(queryset=None, date_from=None, date_to=None, statuses=None):
+    """
+    Заказы для выгрузки: даты включительно (по дате создания), statuses - список статусов.
+    """
+    queryset = Order.objects.all() if queryset is None else queryset
+    if date_from:
+        queryset = queryset.filter(created_at__date__gte=date_from)
+    if date_to:
+        queryset = queryset.filter(created_at__date__lte=date_to)
+    if statuses:
+        queryset = queryset.filter(status__in=statuses)
+    return queryset
+
+
+def get_lines(cart_ids):
+    lines = {}
+    values = (CartProduct.objects.filter(cart_id__in=cart_ids).order_by('cart_id', 'id')
+              .values_list('cart_id', 'product__name', 'size__size', 'qty', 'final_price'))
+    for cart_id, product, size, qty, price in values:
+        lines.setdefault(cart_id, []).append({
+            'product': product, 'size': str(size.normalize()) if size is not None else '',
+            'qty': qty, 'line_price': str(price),
+        })
+    return lines
+
+
+def iter_orders(queryset, chunk_size=1000):
+    """
+    Заказы со строками корзины. Заказы читаются iterator(chunk_size), строки - одним запросом
+    на пачку заказов, поэтому в памяти не больше chunk_size заказов.
+    """
+    rows = (queryset.select_related(None).prefetch_related(None).order_by('id')
+            .values_list(*ORDER_LOOKUPS).iterator(chunk_size=chunk_size))
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        lines = get_lines([row[-1] for row in chunk if row[-1] is not None])
+        for row in chunk:
+            order = dict(zip(ORDER_FIELDS, row))
+            order['created_at'] = timezone.localtime(order['created_at']).isoformat()
+            order['customer'] = order['customer'] or ''
+            order['comment'] = order['comment'] or ''
+            order['final_price'] = str(order['final_price']) if order['final_price'] is not None else ''
+            order['lines'] = lines.get(row[-1], [])
+            yield order
+
+
+class Echo(object):
+    """Буфер для csv.writer: строка возвращается, а не записывается"""
+
+    def write(self, value):
+        return value
+
+
+def escape_cell(value):
+    """
+    Текст, который табличный редактор примет за формулу (=, +, -, @), выводится с апострофом.
+    """
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def stream_orders(queryset, file_format, chunk_size=1000):
+    """
+    Выгрузка по частям: CSV - строка на каждую позицию заказа (заказ без позиций - одна строка),
+    JSONL - объект заказа с вложенными позициями.
+    """
+    if file_format == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(ORDER_FIELDS + LINE_FIELDS)
+        for order in iter_orders(queryset, chunk_size):
+            head = [order[name] for name in ORDER_FIELDS]
+            for line in order['lines'] or [dict.fromkeys(LINE_FIELDS, '')]:
+                yield writer.writerow([escape_cell(value) for value in head + [line[name] for name in LINE_FIELDS]])
+    else:
+        for order in iter_orders(queryset, chunk_size):
+            yield json.dumps(order, ensure_ascii=False) + '\n'
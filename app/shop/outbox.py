@@ -0,0 +1,121 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, OperationalError
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import EmailOutbox
+from .services import build_order_email
+
+logger = logging.getLogger(__name__)
+
+
+def queue_order_email(order):
+    """
+    Письмо о заказе записывается в той же транзакции, что и заказ, и отправляется воркером.
+    """
+    return EmailOutbox.objects.create(order=order)
+
+
+def get_due_messages(limit):
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.EMAIL_OUTBOX_LOCK_TIMEOUT)
+    return list(EmailOutbox.objects.filter(
+        Q(status=EmailOutbox.STATUS_PENDING, available_at__lte=now) |
+        Q(status=EmailOutbox.STATUS_SENDING, locked_at__lt=stale)
+    ).values_list('id', flat=True)[:limit])
+
+
+def claim(message_id):
+    """
+    Захват письма условным UPDATE, чтобы несколько воркеров не отправили его дважды.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.EMAIL_OUTBOX_LOCK_TIMEOUT)
+    return EmailOutbox.objects.filter(
+        Q(status=EmailOutbox.STATUS_PENDING) | Q(status=EmailOutbox.STATUS_SENDING, locked_at__lt=stale),
+        id=message_id
+    ).update(status=EmailOutbox.STATUS_SENDING, locked_at=now)
+
+
+def retry_locked(func, *args, attempts=5, delay=0.05):
+    """
+    Повтор операции с БД, если таблица занята другим потоком (SQLite).
+    """
+    for attempt in range(attempts):
+        try:
+            return func(*args)
+        except OperationalError:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(delay * (attempt + 1))
+
+
+def get_backoff(attempts):
+    return timedelta(seconds=settings.EMAIL_OUTBOX_BACKOFF * 2 ** (attempts - 1))
+
+
+def deliver(message_id):
+    """
+    Отправка одного письма. При ошибке - повтор с экспоненциальной задержкой,
+    после EMAIL_OUTBOX_MAX_ATTEMPTS попыток письмо помечается как неотправленное.
+    """
+    if not retry_locked(claim, message_id):
+        return None
+    message = None
+    try:
+        message = retry_locked(lambda: EmailOutbox.objects.select_related('order__cart').get(id=message_id))
+        email = retry_locked(build_order_email, message.order)
+        email.send()
+    except Exception as error:
+        if message is None:
+            message = EmailOutbox.objects.filter(id=message_id).first()
+            if message is None:
+                return False
+        message.attempts += 1
+        message.last_error = repr(error)
+        message.locked_at = None
+        if message.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+            message.status = EmailOutbox.STATUS_FAILED
+        else:
+            message.status = EmailOutbox.STATUS_PENDING
+            message.available_at = timezone.now() + get_backoff(message.attempts)
+        retry_locked(message.save)
+        return False
+    message.attempts += 1
+    message.status = EmailOutbox.STATUS_SENT
+    message.sent_at = timezone.now()
+    message.locked_at = None
+    message.last_error = ''
+    retry_locked(message.save)
+    return True
+
+
+def deliver_in_thread(message_id):
+    """
+    Ошибка одного письма не должна прерывать отправку остальных писем пачки.
+    """
+    try:
+        return deliver(message_id)
+    except Exception:
+        logger.exception('Ошибка отправки письма %s', message_id)
+        return False
+    finally:
+        connection.close()
+
+
+def send_pending(workers=1, batch=100):
+    """
+    Отправка готовых к отправке писем. Возвращает (отправлено, ошибок).
+    """
+    message_ids = get_due_messages(batch)
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(deliver_in_thread, message_ids))
+    else:
+        results = [deliver(message_id) for message_id in message_ids]
+    return results.count(True), results.count(False)
@@ -0,0 +1,105 @@
+from django.conf import settings
+
+
+class KeysetPage(object):
+    """
+    Страница товаров по ключу (id) без OFFSET.
+    Курсор after - следующая страница (id меньше), before - предыдущая (id больше).
+    """
+
+    def __init__(self, items, query, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.query = query
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.prev_cursor is not None
+
+    def next_query(self):
+        return self._cursor_query('after', self.next_cursor)
+
+    def previous_query(self):
+        return self._cursor_query('before', self.prev_cursor)
+
+    def _cursor_query(self, name, cursor):
+        query = self.query.copy()
+        for key in ('after', 'before', 'fragment'):
+            query.pop(key, None)
+        query[name] = cursor
+        return query.urlencode()
+
+
+def get_cursor(query, name):
+    try:
+        cursor = int(query.get(name, ''))
+    except ValueError:
+        return None
+    return cursor if cursor > 0 else None
+
+
+def get_page_size(query, default=None, maximum=None):
+    default = default or settings.PRODUCTS_PAGE_SIZE
+    try:
+        size = int(query.get('limit', default))
+    except ValueError:
+        size = default
+    return max(1, min(size, maximum or settings.PRODUCTS_PAGE_SIZE_MAX))
+
+
+def paginate_keyset(queryset, request, page_size=None, max_page_size=None):
+    """
+    Выборка limit + 1 строк по индексу id: лишняя строка показывает, есть ли еще страница.
+    """
+    query = request.GET
+    size = get_page_size(query, page_size, max_page_size)
+    after = get_cursor(query, 'after')
+    before = get_cursor(query, 'before')
+
+    if before is not None:
+        items = list(queryset.filter(id__gt=before).order_by('id')[:size + 1])
+        has_more = len(items) > size
+        items = items[:size][::-1]
+        next_cursor = items[-1].id if items else before
+        prev_cursor = items[0].id if items and has_more else None
+    else:
+        if after is not None:
+            queryset = queryset.filter(id__lt=after)
+        items = list(queryset.order_by('-id')[:size + 1])
+        has_more = len(items) > size
+        items = items[:size]
+        next_cursor = items[-1].id if has_more else None
+        prev_cursor = items[0].id if items and after is not None else None
+    return KeysetPage(items, query, next_cursor, prev_cursor)
+
+
+def paginate_ranked(queryset, ranked_ids, request, page_size=None, max_page_size=None):
+    """
+    Страница результатов поиска: курсор - id товара, позиция ищется в списке по релевантности.
+    """
+    query = request.GET
+    size = get_page_size(query, page_size, max_page_size)
+    after = get_cursor(query, 'after')
+    before = get_cursor(query, 'before')
+
+    if before is not None and before in ranked_ids:
+        end = ranked_ids.index(before)
+        start = max(0, end - size)
+    else:
+        start = ranked_ids.index(after) + 1 if after in ranked_ids else 0
+        end = start + size
+    page_ids = ranked_ids[start:end]
+    products = queryset.in_bulk(page_ids)
+    items = [products[pk] for pk in page_ids if pk in products]
+    next_cursor = page_ids[-1] if page_ids and end < len(ranked_ids) else None
+    prev_cursor = page_ids[0] if page_ids and start > 0 else None
+    return KeysetPage(items, query, next_cursor, prev_cursor)
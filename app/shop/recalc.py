@@ -0,0 +1,108 @@
+import threading
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+_local = threading.local()
+
+
+def get_pending():
+    return getattr(_local, 'pending', None)
+
+
+@contextmanager
+def defer_recalc():
+    """
+    Пересчет итогов корзин и остатков товаров откладывается до выхода из блока:
+    каждая измененная корзина и каждый товар пересчитываются один раз одним UPDATE.
+    Вложенные блоки присоединяются к внешнему.
+    """
+    outer = get_pending() is None
+    if outer:
+        _local.pending = {'carts': set(), 'products': set()}
+    try:
+        yield
+    finally:
+        if outer:
+            pending, _local.pending = _local.pending, None
+            run_recalc(pending)
+
+
+def flush_recalc():
+    """
+    Пересчет накопленного в defer_recalc сразу, не дожидаясь конца запроса: вызывается
+    внутри транзакции, которая изменила размеры и строки, чтобы остатки сохранились вместе с ними.
+    """
+    pending = get_pending()
+    if pending is not None:
+        run_recalc({'carts': pending['carts'], 'products': pending['products']})
+        pending['carts'], pending['products'] = set(), set()
+
+
+def run_recalc(pending):
+    from .services import bump_catalog_version
+
+    recalc_products(pending['products'])
+    recalc_carts(pending['carts'])
+    if pending['products']:
+        transaction.on_commit(bump_catalog_version)
+
+
+def schedule_cart_recalc(cart_id):
+    """
+    Возвращает True, если пересчет отложен, иначе корзину нужно пересчитать сразу.
+    """
+    pending = get_pending()
+    if pending is None:
+        return False
+    pending['carts'].add(cart_id)
+    return True
+
+
+def schedule_product_recalc(product_id):
+    pending = get_pending()
+    if pending is None:
+        return False
+    pending['products'].add(product_id)
+    return True
+
+
+def recalc_products(product_ids):
+    """
+    Остаток товара с размерами = сумма остатков размеров; один UPDATE на все товары.
+    """
+    from .models import Product, Size
+
+    if isinstance(product_ids, (set, list, tuple)) and not product_ids:
+        return
+    sizes_qty = Size.objects.filter(product=OuterRef('pk')).values('product').annotate(
+        total=Sum('qty')).values('total')
+    Product.objects.filter(id__in=product_ids).update(qty=Coalesce(Subquery(sizes_qty), 0))
+
+
+def recalc_carts(cart_ids):
+    from .models import Cart, CartProduct
+
+    if isinstance(cart_ids, (set, list, tuple)) and not cart_ids:
+        return
+    lines = CartProduct.objects.filter(cart=OuterRef('pk')).values('cart')
+    Cart.objects.filter(id__in=cart_ids).update(
+        final_price=Coalesce(Subquery(lines.annotate(total=Sum('final_price')).values('total')), 0),
+        total_product=Coalesce(Subquery(lines.annotate(total=Sum('qty')).values('total')), 0),
+    )
+
+
+def reprice_open_carts(product_ids):
+    """
+    Пересчет строк открытых корзин по текущим ценам товаров и итогов этих корзин:
+    два UPDATE независимо от количества корзин.
+    """
+    from .models import CartProduct, Product
+
+    lines = CartProduct.objects.filter(product_id__in=product_ids, cart__in_order=False)
+    price = Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('price')[:1])
+    lines.update(final_price=ExpressionWrapper(F('qty') * price,
+                                               output_field=DecimalField(max_digits=9, decimal_places=2)))
+    recalc_carts(lines.values('cart_id'))
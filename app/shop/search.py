@@ -0,0 +1,135 @@
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils.functional import SimpleLazyObject
+from django.utils.module_loading import import_string
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+# Окончания для упрощенного стемминга русских слов (от длинных к коротким)
+RUSSIAN_ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'иях', 'ией', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ете', 'ите',
+    'ой', 'ей', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ую', 'юю', 'ах', 'ях', 'ом', 'ем',
+    'ам', 'ям', 'ов', 'ев', 'ью', 'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+), key=len, reverse=True)
+
+
+def stem(word):
+    """
+    Отсечение окончания: "кольца", "кольцо", "кольцами" -> "кольц".
+    """
+    word = word.lower()
+    for ending in RUSSIAN_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+def get_terms(query):
+    return [stem(word) for word in WORD_RE.findall(query)]
+
+
+class SearchBackend(object):
+    """
+    Поиск товаров. search() возвращает id товаров из queryset по убыванию релевантности.
+    """
+
+    def search(self, query, queryset):
+        raise NotImplementedError
+
+    def update(self, products):
+        pass
+
+    def remove(self, product_ids):
+        pass
+
+    def rebuild(self):
+        pass
+
+
+class SimpleSearchBackend(SearchBackend):
+    """
+    Поиск без индекса (LIKE по названию, описанию и категории).
+    """
+
+    def search(self, query, queryset):
+        terms = get_terms(query)
+        if not terms:
+            return []
+        for term in terms:
+            queryset = queryset.filter(
+                Q(name__icontains=term) | Q(description__icontains=term) | Q(category__name__icontains=term))
+        return list(queryset.order_by('-id').values_list('id', flat=True)[:settings.SEARCH_RESULTS_LIMIT])
+
+
+class SqliteSearchBackend(SearchBackend):
+    """
+    Полнотекстовый индекс SQLite FTS5 (shop_product_fts, rowid = id товара).
+    Ранжирование bm25: название важнее категории, категория важнее описания.
+    """
+    table = 'shop_product_fts'
+    weights = (10.0, 1.0, 4.0)
+
+    def match_expression(self, query):
+        return ' '.join('"{0}"*'.format(term.replace('"', '""')) for term in get_terms(query))
+
+    def search(self, query, queryset):
+        expression = self.match_expression(query)
+        if not expression:
+            return []
+        subquery, params = queryset.values('id').query.sql_with_params()
+        sql = 'SELECT rowid FROM {0} WHERE {0} MATCH %s AND rowid IN ({1}) ORDER BY bm25({0}, {2}) LIMIT %s'.format(
+            self.table, subquery, ', '.join(map(str, self.weights)))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [expression, *params, settings.SEARCH_RESULTS_LIMIT])
+            return [row[0] for row in cursor.fetchall()]
+
+    def update(self, products):
+        rows = [(product.id, product.name, product.description, product.category.name) for product in products]
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany('DELETE FROM {0} WHERE rowid = %s'.format(self.table), [(row[0],) for row in rows])
+            cursor.executemany(
+                'INSERT INTO {0} (rowid, name, description, category) VALUES (%s, %s, %s, %s)'.format(self.table),
+                rows)
+
+    def remove(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany('DELETE FROM {0} WHERE rowid = %s'.format(self.table), [(pk,) for pk in product_ids])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {0}'.format(self.table))
+            cursor.execute(
+                'INSERT INTO {0} (rowid, name, description, category) '
+                'SELECT p.id, p.name, p.description, c.name FROM shop_product p '
+                'INNER JOIN shop_category c ON c.id = p.category_id'.format(self.table))
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    Полнотекстовый поиск PostgreSQL (tsvector, словарь russian).
+    Для больших каталогов нужен GIN-индекс по тому же выражению to_tsvector.
+    """
+    config = 'russian'
+
+    def search(self, query, queryset):
+        from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+
+        terms = get_terms(query)
+        if not terms:
+            return []
+        vector = (SearchVector('name', weight='A', config=self.config) +
+                  SearchVector('category__name', weight='B', config=self.config) +
+                  SearchVector('description', weight='C', config=self.config))
+        search_query = SearchQuery(' & '.join('{0}:*'.format(term) for term in terms),
+                                   search_type='raw', config=self.config)
+        return list(queryset.annotate(rank=SearchRank(vector, search_query))
+                    .filter(rank__gt=0).order_by('-rank', '-id')
+                    .values_list('id', flat=True)[:settings.SEARCH_RESULTS_LIMIT])
+
+
+search_backend = SimpleLazyObject(lambda: import_string(settings.SEARCH_BACKEND)())
@@ -1,65 +1,112 @@
 from .models import CartProduct, Cart, Category, Product
+from .cache_version import bump_version, get_version
+from .pagination import paginate_keyset, paginate_ranked
+from .search import search_backend
+from .stock import StockLine, reserve_stock
+from .recalc import reprice_open_carts
+from .forms import ChangePriceForm
+from decimal import Decimal
 from django.contrib import messages
 from django.shortcuts import get_object_or_404
 from django.core.mail import EmailMessage
 from django.template.loader import render_to_string
 from django.conf import settings
-
-
-def search_product(products, request):
-    search_query = request.GET.get('search', '')
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from datetime import timedelta
+import time
+
+CATEGORY_NAV_CACHE_KEY = 'shop:category_nav'
+CATALOG_VERSION_CACHE_KEY = 'shop:catalog_version'
+CATALOG_MODIFIED_CACHE_KEY = 'shop:catalog_modified'
+
+
+def search_product(products, request, page_size=None, max_page_size=None):
+    """
+    Страница товаров: по релевантности при поиске, иначе по убыванию id.
+    """
+    search_query = request.GET.get('search', '').strip()
     if search_query:
-        products = products.filter(name__icontains=search_query)
-    else:
-        products = products.all()
-    return products
+        return paginate_ranked(products, search_backend.search(search_query, products), request,
+                               page_size, max_page_size)
+    return paginate_keyset(products, request, page_size, max_page_size)
 
 
 def make_order_user(request, order, cart):
+    items = list(cart.cartproduct_set.select_related('product', 'size'))
+    reserve_stock(StockLine(item.product, item.qty, item.size) for item in items)
+    transaction.on_commit(bump_catalog_version)
     order.customer = request.user
     cart.in_order = True
-    cart.save()
-    for item in cart.cartproduct_set.all():
-        if item.size is not None:
-            size = item.size
-            size.qty -= item.qty
-            size.save()
-        else:
-            product = item.product
-            product.qty -= item.qty
-            product.save()
+    cart.save(update_fields=['in_order'])
     order.cart = cart
     order.save()
 
 
 def make_order_anonymous_user(cart, order):
+    items = list(cart)
+    reserve_stock(StockLine(item['product'], item['qty'], item.get('size_obj')) for item in items)
+    transaction.on_commit(bump_catalog_version)
     cart_db = Cart.objects.create(total_product=cart.get_total_items(),
                                   final_price=cart.get_total_price(), in_order=True)
-    for item in cart:
-        if item.get('size') is not None:
-            CartProduct.objects.create(product=item['product'], cart=cart_db, size=item['size_obj'], qty=item['qty'],
-                                       final_price=item['final_price'])
-            size = item['size_obj']
-            size.qty -= item['qty']
-            size.save()
-        else:
-            CartProduct.objects.create(product=item['product'], cart=cart_db, qty=item['qty'],
-                                       final_price=item['final_price'])
-            product = item['product']
-            product.qty -= item['qty']
-            product.save()
+    CartProduct.objects.bulk_create(
+        CartProduct(product=item['product'], cart=cart_db, size=item.get('size_obj'), qty=item['qty'],
+                    final_price=item['final_price'])
+        for item in items
+    )
     order.cart = cart_db
     order.save()
     cart.clear()
 
 
 def get_products(request):
-    products = Product.objects.all()
+    products = Product.objects.select_related('category')
     return search_product(products, request)
 
 
 def get_category():
-    return Category.objects.all()
+    """
+    Категории для меню с количеством товаров (из кэша).
+    """
+    categories = cache.get(CATEGORY_NAV_CACHE_KEY)
+    if categories is None:
+        categories = list(Category.objects.annotate(product_count=Count('product')))
+        cache.set(CATEGORY_NAV_CACHE_KEY, categories, settings.CATEGORY_NAV_CACHE_TIMEOUT)
+    return categories
+
+
+def clear_category_cache():
+    cache.delete(CATEGORY_NAV_CACHE_KEY)
+
+
+def get_catalog_version():
+    """
+    Поколение каталога: меняется при любом изменении товаров и категорий и входит в ключи кэша страниц.
+    Начальное значение берется от времени, чтобы после вытеснения ключа не совпасть со старым.
+    """
+    return get_version(CATALOG_VERSION_CACHE_KEY, int(time.time() * 1000))
+
+
+def get_catalog_modified():
+    """
+    Время первого обращения к текущему поколению каталога: Last-Modified для API без запросов к БД.
+    Новое поколение всегда получает время позже предыдущего, даже в пределах одной секунды.
+    """
+    version = get_catalog_version()
+    cached = cache.get(CATALOG_MODIFIED_CACHE_KEY)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    modified = timezone.now().replace(microsecond=0)
+    if cached is not None and modified <= cached[1]:
+        modified = cached[1] + timedelta(seconds=1)
+    cache.set(CATALOG_MODIFIED_CACHE_KEY, (version, modified), None)
+    return modified
+
+
+def bump_catalog_version():
+    bump_version(CATALOG_VERSION_CACHE_KEY, int(time.time() * 1000))
 
 
 def get_category_name(slug):
@@ -68,7 +115,7 @@ def get_category_name(slug):
 
 def get_category_products(slug, request):
     category = get_category_name(slug)
-    products = category.product_set.all()
+    products = category.product_set.select_related('category')
     return search_product(products, request)
 
 
@@ -78,7 +125,7 @@ def delete_from_cart_product_id(id):
 
 
 def validation_checkout_user(request, cart):
-    for item in cart.cartproduct_set.all():
+    for item in cart.cartproduct_set.select_related('product', 'size'):
         if item.size:
             if item.size.qty < item.qty and item.size.qty != 0:
                 cart_product = item
@@ -106,15 +153,11 @@ def validation_checkout_user(request, cart):
                 return True
 
 
-def validation_checkout_anonymous_user(request, cart_data, size_num=None):
-    for item in cart_data.cart.values():
-        if len(str(item['id']).split('-')) == 2:
-            size_num = str(item['id']).split('-')[1]
-        product_id = str(item['id']).split('-')[0]
-        product_obj = get_object_or_404(Product, id=product_id)
-        if size_num is not None:
-            print(size_num)
-            size = product_obj.size_set.filter(size=size_num).first()
+def validation_checkout_anonymous_user(request, cart_data):
+    for item in list(cart_data):
+        product_obj = item['product']
+        if item.get('size') is not None:
+            size = item['size_obj']
             if size:
                 if size.qty < item['qty'] and size.qty != 0:
                     cart_data.change_qty(item['id'], size.qty)
@@ -137,7 +180,7 @@ def validation_checkout_anonymous_user(request, cart_data, size_num=None):
                 messages.error(request, 'Товара нет в наличии {0}'.format(product_obj.name))
                 cart_data.remove(item['id'])
                 return True
-        size_num = None
+
 
 def change_qty(request, id, qty):
     cart_product = get_object_or_404(CartProduct, id=id)
@@ -169,7 +212,7 @@ def add_to_cart_user(request, customer, cart, product):
     messages.success(request, "Товар успешно добавлен")
 
 
-def email_message(order):
+def build_order_email(order):
     subject = f'Заказ #{order.pk}'
     context = {'order_id': order.pk,
                'last_name': order.last_name,
@@ -177,11 +220,10 @@ def email_message(order):
                'phone': order.phone,
                'address': order.address,
                'order_date': order.created_at,
-               'items': order.cart.cartproduct_set.all()
+               'items': order.cart.cartproduct_set.select_related('product', 'size')
                }
     message = render_to_string('shop/message_email.html', context)
-    em = EmailMessage(subject=subject, body=message, to=[settings.EMAIL_MESSAGE_TO])
-    em.send()
+    return EmailMessage(subject=subject, body=message, to=[settings.EMAIL_MESSAGE_TO])
 
 
 def get_size_sneaker(product: object) -> object:
@@ -213,3 +255,21 @@ def add_to_cart(request, sizes_stock: list, product: object, cart: object):
                 messages.success(request, 'Товар {0} | Размер ({1}) добавлены в корзину'.format(product.name, size))
             else:
                 cart.add_with_size(product, size_num)
+
+
+def bulk_change_price(products, mode, value):
+    """
+    Изменение цены у многих товаров: bulk_update цен и пересчет открытых корзин пачкой.
+    """
+    products = list(products.select_related(None).only('id', 'price', 'updated_at'))
+    for product in products:
+        if mode == ChangePriceForm.MODE_PERCENT:
+            price = product.price * (1 + value / 100)
+        else:
+            price = value
+        product.price = Decimal(price).quantize(Decimal('0.01'))
+        product.updated_at = timezone.now()
+    Product.objects.bulk_update(products, ['price', 'updated_at'], batch_size=500)
+    reprice_open_carts([product.id for product in products])
+    transaction.on_commit(bump_catalog_version)
+    return len(products)
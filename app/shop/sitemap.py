@@ -1,6 +1,11 @@
+from functools import wraps
+
+from django.conf import settings
 from django.contrib.sitemaps import Sitemap
+from django.core.cache import cache
 from django.urls import reverse
 from .models import Product, Category
+from .services import get_catalog_version
 
 
 class StaticSitemap(Sitemap):
@@ -14,17 +19,45 @@ class StaticSitemap(Sitemap):
         return reverse(item)
 
 
-class ItemSitemap(Sitemap):
-    priority = 0.50
+class CatalogSitemap(Sitemap):
+    """Раздел каталога, разбитый на страницы по SITEMAP_PAGE_SIZE ссылок"""
     changefreq = 'daily'
 
+    @property
+    def limit(self):
+        return settings.SITEMAP_PAGE_SIZE
+
+    def lastmod(self, obj):
+        return obj.updated_at
+
+
+class ItemSitemap(CatalogSitemap):
+    priority = 0.50
+
     def items(self):
-        return Product.objects.all()
+        return Product.objects.select_related('category').only(
+            'slug', 'updated_at', 'category__slug').order_by('id')
 
 
-class CategorySitemap(Sitemap):
+class CategorySitemap(CatalogSitemap):
     priority = 0.75
-    changefreq = 'daily'
 
     def items(self):
-        return Category.objects.all()
+        return Category.objects.only('slug', 'updated_at').order_by('id')
+
+
+def cached_sitemap(view):
+    """
+    Готовый XML хранится в кэше до следующего изменения каталога.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = 'shop:sitemap:{0}:{1}'.format(get_catalog_version(), request.get_full_path())
+        response = cache.get(key)
+        if response is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200:
+                response.render()
+                cache.set(key, response, settings.SITEMAP_CACHE_TIMEOUT)
+        return response
+    return wrapper
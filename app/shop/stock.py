@@ -0,0 +1,64 @@
+from django.db import transaction
+from django.db.models import F
+
+from .models import Product, Size
+from .recalc import recalc_products
+
+
+class StockLine(object):
+    """Строка списания: товар, размер (если есть) и количество"""
+
+    def __init__(self, product, qty, size=None):
+        self.product = product
+        self.size = size
+        self.qty = qty
+        self.available = None
+
+    def __str__(self):
+        if self.size is not None:
+            return '{0} | Размер ({1})'.format(self.product.name, self.size.size.normalize())
+        return self.product.name
+
+
+class OutOfStock(Exception):
+    def __init__(self, lines):
+        super().__init__(', '.join(map(str, lines)))
+        self.lines = lines
+
+
+def merge_lines(lines):
+    merged = {}
+    for line in lines:
+        key = (line.product.id, line.size.id if line.size is not None else None)
+        if key in merged:
+            merged[key].qty += line.qty
+        else:
+            merged[key] = StockLine(line.product, line.qty, line.size)
+    return list(merged.values())
+
+
+def reserve_stock(lines):
+    """
+    Списание остатков условным UPDATE (qty = qty - n WHERE qty >= n) без чтения строк.
+    Если хотя бы одна строка не списана, все списания откатываются и
+    выбрасывается OutOfStock со списком строк, которых не хватило.
+    """
+    lines = merge_lines(lines)
+    failed = []
+    with transaction.atomic():
+        sized_products = set()
+        for line in lines:
+            if line.size is not None:
+                updated = Size.objects.filter(id=line.size.id, qty__gte=line.qty).update(qty=F('qty') - line.qty)
+                sized_products.add(line.product.id)
+            else:
+                updated = Product.objects.filter(id=line.product.id, qty__gte=line.qty).update(
+                    qty=F('qty') - line.qty)
+            if not updated:
+                failed.append(line)
+        if failed:
+            for line in failed:
+                model, pk = (Size, line.size.id) if line.size is not None else (Product, line.product.id)
+                line.available = model.objects.filter(id=pk).values_list('qty', flat=True).first() or 0
+            raise OutOfStock(failed)
+        recalc_products(sized_products)
@@ -0,0 +1,116 @@
+import threading
+from bisect import bisect_left, insort
+
+from django.conf import settings
+
+from .cache_version import bump_version, get_version
+from .models import Product
+
+SUGGEST_VERSION_CACHE_KEY = 'shop:suggest_version'
+
+
+def normalize(text):
+    return ' '.join(text.lower().replace('ё', 'е').split())
+
+
+def get_keys(name, slug):
+    """
+    Ключи товара: название с начала каждого слова ("кольцо" найдет "Обручальное кольцо") и slug.
+    """
+    words = normalize(name).split(' ')
+    keys = {' '.join(words[i:]) for i in range(len(words))}
+    keys.add(slug.lower())
+    keys.discard('')
+    return keys
+
+
+class PrefixIndex(object):
+    """
+    Префиксный индекс названий и slug товаров в памяти процесса: отсортированный список
+    (ключ, id товара) и поиск через bisect. Индекс перестраивается, когда счетчик
+    SUGGEST_VERSION_CACHE_KEY ушел вперед; свои изменения процесс применяет на месте.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.keys = []
+        self.entries = {}
+        self.version = None
+
+    def get_shared_version(self):
+        return get_version(SUGGEST_VERSION_CACHE_KEY)
+
+    def bump_shared_version(self):
+        version = bump_version(SUGGEST_VERSION_CACHE_KEY)
+        if self.version is not None and version == self.version + 1:
+            self.version = version
+        else:
+            self.version = None
+
+    def rebuild(self):
+        version = self.get_shared_version()
+        keys, entries = [], {}
+        for product in Product.objects.select_related('category').only('name', 'slug', 'category__slug'):
+            entry = (product.name, product.get_absolute_url(), get_keys(product.name, product.slug))
+            entries[product.id] = entry
+            keys.extend((key, product.id) for key in entry[2])
+        keys.sort()
+        with self.lock:
+            self.keys, self.entries, self.version = keys, entries, version
+
+    def ensure_fresh(self):
+        if self.version is None or self.version != self.get_shared_version():
+            self.rebuild()
+
+    def _remove(self, product_id):
+        entry = self.entries.pop(product_id, None)
+        if entry is None:
+            return
+        for key in entry[2]:
+            i = bisect_left(self.keys, (key, product_id))
+            if i < len(self.keys) and self.keys[i] == (key, product_id):
+                del self.keys[i]
+
+    def update(self, products):
+        with self.lock:
+            if self.version is not None:
+                for product in products:
+                    self._remove(product.id)
+                    entry = (product.name, product.get_absolute_url(), get_keys(product.name, product.slug))
+                    self.entries[product.id] = entry
+                    for key in entry[2]:
+                        insort(self.keys, (key, product.id))
+        self.bump_shared_version()
+
+    def remove(self, product_ids):
+        with self.lock:
+            if self.version is not None:
+                for product_id in product_ids:
+                    self._remove(product_id)
+        self.bump_shared_version()
+
+    def suggest(self, prefix, limit):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        self.ensure_fresh()
+        results, seen = [], set()
+        with self.lock:
+            keys = self.keys
+            i = bisect_left(keys, (prefix,))
+            while i < len(keys) and len(results) < limit and keys[i][0].startswith(prefix):
+                product_id = keys[i][1]
+                if product_id not in seen:
+                    seen.add(product_id)
+                    name, url, _ = self.entries[product_id]
+                    results.append({'name': name, 'url': url})
+                i += 1
+        return results
+
+
+suggest_index = PrefixIndex()
+
+
+def get_suggestions(query, limit=None):
+    limit = max(1, min(limit or settings.SUGGEST_LIMIT, settings.SUGGEST_LIMIT))
+    return suggest_index.suggest(query, limit)
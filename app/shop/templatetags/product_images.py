@@ -0,0 +1,28 @@
+from django import template
+from django.utils.html import format_html
+
+from shop.images import get_fallback_suffix, get_srcset, parse_widths
+
+register = template.Library()
+
+
+@register.simple_tag
+def product_image(image, sizes='100vw', css_class='', alt='', width=None):
+    """
+    <picture> с уменьшенными копиями: WebP и запасной формат через srcset, оригинал - в src.
+    Если копий еще нет (Product.image_widths пуст), выводится только <img> с оригиналом.
+    """
+    if not image:
+        return ''
+    name = image.name
+    widths = parse_widths(getattr(image.instance, 'image_widths', ''))
+    width_attr = format_html(' width="{0}"', width) if width else ''
+    if not widths:
+        return format_html('<img src="{0}" class="{1}" alt="{2}"{3} loading="lazy">',
+                           image.url, css_class, alt, width_attr)
+    return format_html(
+        '<picture><source type="image/webp" srcset="{0}" sizes="{1}">'
+        '<img src="{2}" srcset="{3}" sizes="{1}" class="{4}" alt="{5}"{6} loading="lazy"></picture>',
+        get_srcset(name, '.webp', widths), sizes, image.url, get_srcset(name, get_fallback_suffix(name), widths),
+        css_class, alt, width_attr
+    )
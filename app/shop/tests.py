@@ -1,3 +1,1556 @@
-from django.test import TestCase
+import csv
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core import mail
+from django.core import signing
+from django.core.cache import cache
+from django.core.management import call_command, CommandError
+from django.db import connection, transaction, OperationalError
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.template import Context, Template
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from .cart import CartSession, CartUserView
+from .cart_storage import CART_COOKIE_SALT, decode_cart
+from .catalog import CatalogImporter, iter_catalog
+from .order_export import stream_orders
+from .images import get_derivative_names
+from .models import Category, Product, Size, Cart, CartProduct, Order, EmailOutbox, DailySales
+from . import outbox
+from .outbox import send_pending
+from .recalc import defer_recalc, recalc_products
+from .services import get_catalog_version, get_category
+from .search import search_backend, stem
+from .suggest import suggest_index
+from .stock import OutOfStock, StockLine, reserve_stock
+from .utils import CSRF_TOKEN_RE, CartMixin
+
+BENCH_CATEGORIES = 40
+BENCH_PRODUCTS = 2000
+BENCH_SIZES_PER_PRODUCT = 4
+BENCH_CART_LINES = 30
+BENCH_ORDERS = 20
+
+# Бюджеты представлений: (запросы к БД, секунды, килобайты ответа)
+VIEW_BUDGETS = {
+    ('main_page', 'anonymous'): (10, 5.0, 50),
+    ('main_page', 'user'): (10, 5.0, 50),
+    ('category_detail', 'anonymous'): (10, 5.0, 50),
+    ('category_detail', 'user'): (10, 5.0, 50),
+    ('product_detail', 'anonymous'): (10, 5.0, 20),
+    ('product_detail', 'user'): (12, 5.0, 20),
+    ('cart', 'anonymous'): (10, 5.0, 60),
+    ('cart', 'user'): (10, 5.0, 60),
+    ('checkout', 'anonymous'): (10, 5.0, 40),
+    ('checkout', 'user'): (10, 5.0, 40),
+    ('profile', 'user'): (10, 5.0, 30),
+}
+
+
+def seed_catalog(categories=BENCH_CATEGORIES, products=BENCH_PRODUCTS, sizes_per_product=BENCH_SIZES_PER_PRODUCT):
+    """
+    Заполнение каталога: категории, товары (каждый второй с размерами) и размеры.
+    """
+    Category.objects.bulk_create(
+        Category(name='Категория {0}'.format(i), slug='category-{0}'.format(i)) for i in range(categories)
+    )
+    category_list = list(Category.objects.order_by('id'))
+    Product.objects.bulk_create(
+        (Product(name='Товар {0}'.format(i), slug='product-{0}'.format(i),
+                 category=category_list[i % categories],
+                 description='Описание товара {0}'.format(i),
+                 image='{0}/product-{1}.png'.format(category_list[i % categories].slug, i),
+                 qty=100, price=Decimal('10.50') + i % 50)
+         for i in range(products)),
+        batch_size=500
+    )
+    product_list = list(Product.objects.order_by('id'))
+    Size.objects.bulk_create(
+        (Size(product=product, size=Decimal('15.0') + Decimal('0.5') * j, qty=25)
+         for product in product_list[::2] for j in range(sizes_per_product)),
+        batch_size=500
+    )
+    return category_list, product_list
+
+
+def seed_user_cart(user, product_list, lines=BENCH_CART_LINES, in_order=False):
+    """
+    Корзина пользователя в БД: половина строк с размерами.
+    """
+    cart = Cart.objects.create(customer=user, in_order=in_order)
+    sizes = {size.product_id: size for size in Size.objects.filter(product__in=product_list[:lines])}
+    CartProduct.objects.bulk_create(
+        CartProduct(customer=user, cart=cart, product=product, size=sizes.get(product.id), qty=1,
+                    final_price=product.price)
+        for product in product_list[:lines]
+    )
+    cart.total_product = lines
+    cart.final_price = sum(product.price for product in product_list[:lines])
+    cart.save()
+    return cart
+
+
+def seed_session_cart(client, product_list, lines=BENCH_CART_LINES):
+    """
+    Корзина анонимного пользователя в сессии.
+    """
+    sizes = {size.product_id: size for size in Size.objects.filter(product__in=product_list[:lines])}
+    cart = {}
+    for product in product_list[:lines]:
+        if product.id in sizes:
+            key = '{0}-{1}'.format(product.id, sizes[product.id].size.normalize())
+            cart[key] = {'id': key, 'size': str(sizes[product.id].size.normalize()), 'qty': 1,
+                         'price': str(product.price)}
+        else:
+            key = str(product.id)
+            cart[key] = {'id': key, 'qty': 1, 'price': str(product.price)}
+    session = client.session
+    session[settings.CART_SESSION_ID] = cart
+    session.save()
+
+
+def client_cart(client):
+    """
+    Корзина анонимного посетителя из подписанной cookie тестового клиента.
+    """
+    value = signing.loads(client.cookies[settings.CART_COOKIE_NAME].value, salt=CART_COOKIE_SALT)
+    return decode_cart(value)[0]
+
+
+def run_commit_hooks():
+    """
+    Выполнение колбэков transaction.on_commit внутри транзакции TestCase
+    (в Django 3.1 нет captureOnCommitCallbacks).
+    """
+    callbacks, connection.run_on_commit = connection.run_on_commit, []
+    for sids, func in callbacks:
+        func()
+
+
+class ViewBudgetTests(TestCase):
+    """
+    Количество запросов, время и объем ответа представлений магазина на заполненном каталоге.
+    Таблица замеров выводится в stderr, если задана переменная окружения PERF_REPORT=1.
+    """
+    results = []
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.categories, cls.products = seed_catalog()
+        cls.user = User.objects.create_user('buyer', password='password')
+        seed_user_cart(cls.user, cls.products)
+        for i in range(BENCH_ORDERS):
+            cart = seed_user_cart(cls.user, cls.products[i * 3:], lines=3, in_order=True)
+            Order.objects.create(customer=cls.user, cart=cart, first_name='Иван', last_name='Иванов',
+                                 phone='+375290000000', address='Минск')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        if not os.environ.get('PERF_REPORT'):
+            return
+        sys.stderr.write('\n{0:<18}{1:<11}{2:>9}{3:>10}{4:>10}\n'.format('view', 'visitor', 'queries', 'ms', 'KiB'))
+        for view, visitor, queries, seconds, size in cls.results:
+            sys.stderr.write('{0:<18}{1:<11}{2:>9}{3:>10.1f}{4:>10.1f}\n'.format(
+                view, visitor, queries, seconds * 1000, size / 1024))
+
+    def setUp(self):
+        cache.clear()
+
+    def visit(self, visitor):
+        if visitor == 'user':
+            self.client.force_login(self.user)
+        else:
+            seed_session_cart(self.client, self.products)
+
+    def assertWithinBudget(self, view, visitor, url):
+        self.visit(visitor)
+        max_queries, max_seconds, max_kilobytes = VIEW_BUDGETS[(view, visitor)]
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = self.client.get(url)
+            seconds = time.perf_counter() - start
+        self.assertEqual(response.status_code, 200)
+        self.results.append((view, visitor, len(queries), seconds, len(response.content)))
+        self.assertLessEqual(len(queries), max_queries, '{0} ({1}): превышен бюджет запросов'.format(view, visitor))
+        self.assertLessEqual(seconds, max_seconds, '{0} ({1}): превышен бюджет времени'.format(view, visitor))
+        self.assertLessEqual(len(response.content), max_kilobytes * 1024,
+                             '{0} ({1}): превышен бюджет объема ответа'.format(view, visitor))
+
+    def test_main_page_anonymous(self):
+        self.assertWithinBudget('main_page', 'anonymous', reverse('main_page'))
+
+    def test_main_page_user(self):
+        self.assertWithinBudget('main_page', 'user', reverse('main_page'))
+
+    def test_category_detail_anonymous(self):
+        self.assertWithinBudget('category_detail', 'anonymous', self.categories[0].get_absolute_url())
+
+    def test_category_detail_user(self):
+        self.assertWithinBudget('category_detail', 'user', self.categories[0].get_absolute_url())
+
+    def test_product_detail_anonymous(self):
+        self.assertWithinBudget('product_detail', 'anonymous', self.products[0].get_absolute_url())
+
+    def test_product_detail_user(self):
+        self.assertWithinBudget('product_detail', 'user', self.products[0].get_absolute_url())
+
+    def test_cart_anonymous(self):
+        self.assertWithinBudget('cart', 'anonymous', reverse('cart'))
+
+    def test_cart_user(self):
+        self.assertWithinBudget('cart', 'user', reverse('cart'))
+
+    def test_checkout_anonymous(self):
+        self.assertWithinBudget('checkout', 'anonymous', reverse('checkout'))
+
+    def test_checkout_user(self):
+        self.assertWithinBudget('checkout', 'user', reverse('checkout'))
+
+    def test_profile_user(self):
+        self.assertWithinBudget('profile', 'user', reverse('profile'))
+
+
+class CategoryNavTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.categories, cls.products = seed_catalog(categories=5, products=20, sizes_per_product=0)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_counts_are_annotated(self):
+        counts = {category.slug: category.product_count for category in get_category()}
+        self.assertEqual(counts, {category.slug: 4 for category in self.categories})
+
+    def test_warm_cache_costs_no_queries(self):
+        get_category()
+        with self.assertNumQueries(0):
+            self.assertEqual(len(get_category()), 5)
+
+    def test_invalidated_on_product_save_and_delete(self):
+        get_category()
+        product = self.products[0]
+        product.category = self.categories[1]
+        product.save()
+        run_commit_hooks()
+        counts = {category.slug: category.product_count for category in get_category()}
+        self.assertEqual(counts[self.categories[0].slug], 3)
+        self.assertEqual(counts[self.categories[1].slug], 5)
+        product.delete()
+        run_commit_hooks()
+        counts = {category.slug: category.product_count for category in get_category()}
+        self.assertEqual(counts[self.categories[1].slug], 4)
+
+    def test_invalidated_on_category_save(self):
+        get_category()
+        Category.objects.create(name='Новая', slug='new')
+        run_commit_hooks()
+        self.assertEqual(len(get_category()), 6)
+
+
+@override_settings(PRODUCTS_PAGE_SIZE=10, PRODUCTS_PAGE_SIZE_MAX=20)
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.categories, cls.products = seed_catalog(categories=2, products=35, sizes_per_product=0)
+
+    def setUp(self):
+        cache.clear()
+
+    def get_page(self, url, **params):
+        return self.client.get(url, params).context['products']
+
+    def test_pages_cover_catalog_without_duplicates(self):
+        seen = []
+        page = self.get_page(reverse('main_page'))
+        while True:
+            seen.extend(product.id for product in page)
+            if not page.has_next():
+                break
+            page = self.get_page(reverse('main_page'), after=page.next_cursor)
+        self.assertEqual(seen, sorted((product.id for product in self.products), reverse=True))
+
+    def test_previous_cursor_returns_previous_page(self):
+        first = self.get_page(reverse('main_page'))
+        second = self.get_page(reverse('main_page'), after=first.next_cursor)
+        self.assertTrue(second.has_previous())
+        previous = self.get_page(reverse('main_page'), before=second.prev_cursor)
+        self.assertEqual([p.id for p in previous], [p.id for p in first])
+        self.assertFalse(previous.has_previous())
+
+    def test_cursor_survives_concurrent_insert(self):
+        first = self.get_page(reverse('main_page'))
+        expected = [p.id for p in self.get_page(reverse('main_page'), after=first.next_cursor)]
+        Product.objects.create(name='Новый', slug='new', category=self.categories[0], image='new.png',
+                               qty=1, price=1)
+        run_commit_hooks()
+        second = self.get_page(reverse('main_page'), after=first.next_cursor)
+        self.assertEqual([p.id for p in second], expected)
+
+    def test_page_size_is_limited(self):
+        self.assertEqual(len(self.get_page(reverse('main_page'), limit=1000)), 20)
+        self.assertEqual(len(self.get_page(reverse('main_page'), limit=0)), 1)
+        self.assertEqual(len(self.get_page(reverse('main_page'), limit='x')), 10)
+
+    def test_category_listing_is_paginated(self):
+        page = self.get_page(self.categories[0].get_absolute_url(), after='bad')
+        self.assertEqual(len(page), 10)
+        self.assertTrue(all(product.category_id == self.categories[0].id for product in page))
+
+    def test_load_more_returns_card_fragment(self):
+        first = self.get_page(reverse('main_page'))
+        response = self.client.get(reverse('main_page'), {'after': first.next_cursor, 'fragment': 1})
+        self.assertTemplateUsed(response, 'shop/product_list.html')
+        self.assertTemplateNotUsed(response, 'base.html')
+        self.assertContains(response, 'card-title', count=10)
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.rings = Category.objects.create(name='Кольца', slug='rings')
+        cls.chains = Category.objects.create(name='Цепи', slug='chains')
+        cls.ring = Product.objects.create(name='Обручальное кольцо', slug='ring', category=cls.rings,
+                                          description='Розовое золото', image='ring.png', qty=1, price=100)
+        cls.chain = Product.objects.create(name='Серебряная цепочка', slug='chain', category=cls.chains,
+                                           description='Подходит к кольцу', image='chain.png', qty=1, price=50)
+        cls.bracelet = Product.objects.create(name='Браслет', slug='bracelet', category=cls.chains,
+                                              description='Золотой браслет', image='bracelet.png', qty=1, price=70)
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, query, url=None):
+        response = self.client.get(url or reverse('main_page'), {'search': query})
+        return [product.slug for product in response.context['products']]
+
+    def test_stem(self):
+        self.assertEqual(stem('Кольца'), 'кольц')
+        self.assertEqual(stem('кольцами'), 'кольц')
+        self.assertEqual(stem('цепь'), 'цеп')
+
+    def test_morphology_and_ranking(self):
+        self.assertEqual(self.search('кольца'), ['ring', 'chain'])
+
+    def test_ranked_pagination(self):
+        first = self.client.get(reverse('main_page'), {'search': 'кольца', 'limit': 1}).context['products']
+        self.assertEqual([product.slug for product in first], ['ring'])
+        second = self.client.get(reverse('main_page'), {'search': 'кольца', 'limit': 1,
+                                                        'after': first.next_cursor}).context['products']
+        self.assertEqual([product.slug for product in second], ['chain'])
+        self.assertFalse(second.has_next())
+        self.assertEqual(second.prev_cursor, self.chain.id)
+
+    def test_prefix_and_description(self):
+        self.assertEqual(sorted(self.search('золот')), ['bracelet', 'ring'])
+
+    def test_category_name(self):
+        self.assertEqual(sorted(self.search('цепи')), ['bracelet', 'chain'])
+
+    def test_search_within_category(self):
+        self.assertEqual(self.search('кольцо', self.chains.get_absolute_url()), ['chain'])
+
+    def test_index_follows_product_changes(self):
+        self.ring.name = 'Помолвочное кольцо'
+        self.ring.save()
+        self.assertEqual(self.search('помолвочное'), ['ring'])
+        self.assertEqual(self.search('обручальное'), [])
+        Product.objects.filter(slug='chain').delete()
+        self.assertEqual(self.search('цепочка'), [])
+
+    def test_index_follows_category_rename(self):
+        self.chains.name = 'Подвески'
+        self.chains.save()
+        self.assertEqual(sorted(self.search('подвеска')), ['bracelet', 'chain'])
+
+    def test_rebuild(self):
+        Product.objects.bulk_create([Product(name='Серьги', slug='earrings', category=self.rings,
+                                             image='earrings.png', qty=1, price=30)])
+        self.assertEqual(self.search('серьги'), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.search('серьги'), ['earrings'])
+
+
+class SuggestTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.rings = Category.objects.create(name='Кольца', slug='rings')
+        cls.ring = Product.objects.create(name='Обручальное кольцо', slug='wedding-ring', category=cls.rings,
+                                          image='ring.png', qty=1, price=100)
+        cls.gold = Product.objects.create(name='Кольцо из золота', slug='gold-ring', category=cls.rings,
+                                          image='gold.png', qty=1, price=200)
+
+    def setUp(self):
+        cache.clear()
+        suggest_index.version = None
+
+    def suggest(self, query, **params):
+        response = self.client.get(reverse('search_suggest'), {'q': query, **params})
+        return [item['name'] for item in response.json()['results']]
+
+    def test_prefix_of_any_word_and_slug(self):
+        self.assertEqual(self.suggest('кол'), ['Обручальное кольцо', 'Кольцо из золота'])
+        self.assertEqual(self.suggest('ОБРУЧ'), ['Обручальное кольцо'])
+        self.assertEqual(self.suggest('gold'), ['Кольцо из золота'])
+        self.assertEqual(self.suggest('серьги'), [])
+        self.assertEqual(self.suggest(''), [])
+
+    def test_results_carry_absolute_url_and_limit(self):
+        response = self.client.get(reverse('search_suggest'), {'q': 'обруч'})
+        self.assertEqual(response.json()['results'], [{'name': 'Обручальное кольцо',
+                                                       'url': self.ring.get_absolute_url()}])
+        self.assertEqual(len(self.suggest('кол', limit=1)), 1)
+
+    def test_warm_index_costs_no_queries(self):
+        self.suggest('кол')
+        with self.assertNumQueries(0):
+            self.suggest('кол')
+
+    def test_incremental_update_on_save_and_delete(self):
+        self.suggest('кол')
+        product = Product.objects.create(name='Колье', slug='necklace', category=self.rings, image='n.png',
+                                         qty=1, price=10)
+        with self.assertNumQueries(0):
+            self.assertIn('Колье', self.suggest('колье'))
+        product.name = 'Подвеска'
+        product.save()
+        self.assertEqual(self.suggest('колье'), [])
+        self.assertEqual(self.suggest('подв'), ['Подвеска'])
+        Product.objects.filter(slug='necklace').delete()
+        self.assertEqual(self.suggest('подв'), [])
+
+    def test_lookup_is_under_a_millisecond(self):
+        seed_catalog(categories=10, products=BENCH_PRODUCTS, sizes_per_product=0)
+        suggest_index.suggest('товар', 10)
+        start = time.perf_counter()
+        for i in range(1000):
+            suggest_index.suggest('товар {0}'.format(i), 10)
+        self.assertLess((time.perf_counter() - start) / 1000, 0.001)
+
+    def test_stale_version_triggers_rebuild(self):
+        self.suggest('кол')
+        Product.objects.bulk_create([Product(name='Колье', slug='necklace', category=self.rings,
+                                             image='n.png', qty=1, price=10)])
+        self.assertEqual(self.suggest('колье'), [])
+        cache.incr('shop:suggest_version')
+        self.assertEqual(self.suggest('колье'), ['Колье'])
+
+
+class CartSessionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.categories, cls.products = seed_catalog(categories=2, products=60, sizes_per_product=2)
+
+    def get_cart(self, lines):
+        request = RequestFactory().get('/')
+        request.session = SessionStore()
+        cart = CartSession(request)
+        for product in self.products[:lines]:
+            size = product.size_set.first()
+            key = '{0}-{1}'.format(product.id, size.size.normalize()) if size else str(product.id)
+            cart.cart[key] = {'id': key, 'qty': 2, 'price': str(product.price)}
+            if size:
+                cart.cart[key]['size'] = str(size.size.normalize())
+        cart.save()
+        return cart
+
+    def test_iteration_costs_constant_queries(self):
+        for lines in (3, 30):
+            cart = self.get_cart(lines)
+            with self.assertNumQueries(2):
+                items = list(cart)
+            self.assertEqual(len(items), lines)
+            with self.assertNumQueries(0):
+                list(cart)
+                self.assertEqual(cart.get_total_items(), lines * 2)
+
+    def test_items_are_hydrated(self):
+        cart = self.get_cart(4)
+        items = {item['id']: item for item in cart}
+        sized = self.products[0]
+        size = sized.size_set.first()
+        item = items['{0}-{1}'.format(sized.id, size.size.normalize())]
+        self.assertEqual(item['product'], sized)
+        self.assertEqual(item['size_obj'], size)
+        self.assertEqual(item['final_price'], sized.price * 2)
+        self.assertNotIn('size_obj', items[str(self.products[1].id)])
+        self.assertEqual(cart.get_total_price(), sum(product.price * 2 for product in self.products[:4]))
+
+    def test_storage_payload_stays_compact(self):
+        cart = self.get_cart(4)
+        list(cart)
+        payload = cart.storage.load()
+        self.assertEqual(json.loads(json.dumps(payload)), payload)
+        self.assertEqual(payload['l'][1], [self.products[1].id, '', 2, int(self.products[1].price * 100)])
+        self.assertEqual((payload['q'], payload['c']), (8, int(cart.get_total_price() * 100)))
+        self.assertEqual(set(cart.cart[str(self.products[1].id)]), {'id', 'qty', 'price'})
+
+    def test_mutation_resets_hydrated_state(self):
+        cart = self.get_cart(4)
+        list(cart)
+        cart.remove(self.products[1].id)
+        self.assertEqual(cart.get_total_items(), 6)
+        self.assertEqual(len(list(cart)), 3)
+
+
+class CartUserViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.categories, cls.products = seed_catalog(categories=2, products=60, sizes_per_product=2)
+        cls.small = User.objects.create_user('small', password='password')
+        cls.large = User.objects.create_user('large', password='password')
+        seed_user_cart(cls.small, cls.products, lines=3)
+        seed_user_cart(cls.large, cls.products, lines=30)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_iteration_is_one_query(self):
+        cart_view = CartUserView(Cart.objects.get(customer=self.large))
+        with self.assertNumQueries(1):
+            items = list(cart_view)
+            list(cart_view)
+            for item in items:
+                item['product'].image.url, item['product'].price, item.get('size_obj')
+        self.assertEqual(len(items), 30)
+
+    def test_totals_cost_no_queries(self):
+        cart_view = CartUserView(Cart.objects.get(customer=self.large))
+        with self.assertNumQueries(0):
+            self.assertEqual(cart_view.get_total_items(), 30)
+            self.assertEqual(cart_view.get_total_price(), sum(product.price for product in self.products[:30]))
+
+    def test_cart_page_queries_do_not_depend_on_lines(self):
+        counts = []
+        for user in (self.small, self.large):
+            self.client.force_login(user)
+            self.client.get(reverse('cart'))
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(reverse('cart'))
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+class StockReservationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Кольца', slug='rings')
+        cls.plain = Product.objects.create(name='Цепочка', slug='chain', category=cls.category, image='c.png',
+                                           qty=3, price=10)
+        cls.sized = Product.objects.create(name='Кольцо', slug='ring', category=cls.category, image='r.png',
+                                           qty=0, price=20)
+        cls.size = Size.objects.create(product=cls.sized, size=Decimal('17'), qty=2)
+        Size.objects.create(product=cls.sized, size=Decimal('18'), qty=4)
+
+    def test_reserve_decrements_all_lines(self):
+        with self.assertNumQueries(5):
+            reserve_stock([StockLine(self.plain, 2), StockLine(self.sized, 1, self.size),
+                           StockLine(self.sized, 1, self.size)])
+        self.assertEqual(Product.objects.get(id=self.plain.id).qty, 1)
+        self.assertEqual(Size.objects.get(id=self.size.id).qty, 0)
+        self.assertEqual(Product.objects.get(id=self.sized.id).qty, 4)
+
+    def test_failure_reports_lines_and_rolls_back(self):
+        with self.assertRaises(OutOfStock) as context:
+            reserve_stock([StockLine(self.plain, 2), StockLine(self.sized, 3, self.size)])
+        self.assertEqual([str(line) for line in context.exception.lines], ['Кольцо | Размер (17)'])
+        self.assertEqual(context.exception.lines[0].available, 2)
+        self.assertEqual(Product.objects.get(id=self.plain.id).qty, 3)
+        self.assertEqual(Size.objects.get(id=self.size.id).qty, 2)
+
+    def test_checkout_with_missing_stock_creates_no_order(self):
+        seed_session_cart(self.client, [self.plain])
+        session = self.client.session
+        session[settings.CART_SESSION_ID][str(self.plain.id)]['qty'] = 5
+        session.save()
+        response = self.client.post(reverse('make_order'), {
+            'first_name': 'Иван', 'last_name': 'Иванов', 'phone': '+375290000000', 'address': 'Минск',
+            'buying_type': Order.BUYING_TYPE_COURIER, 'payment_type': Order.PAYMENT_TYPE_CASH})
+        self.assertRedirects(response, reverse('cart'), fetch_redirect_response=False)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Product.objects.get(id=self.plain.id).qty, 3)
+
+
+class StockStressTests(TransactionTestCase):
+    threads = 8
+    attempts = 5
+
+    def test_concurrent_reservations_never_oversell(self):
+        category = Category.objects.create(name='Кольца', slug='rings')
+        product = Product.objects.create(name='Кольцо', slug='ring', category=category, image='r.png',
+                                         qty=0, price=20)
+        size = Size.objects.create(product=product, size=Decimal('17'), qty=10)
+        reserved = []
+        start = threading.Barrier(self.threads)
+
+        def worker():
+            start.wait()
+            try:
+                for i in range(self.attempts):
+                    while True:
+                        try:
+                            reserve_stock([StockLine(product, 1, size)])
+                            reserved.append(1)
+                        except OutOfStock:
+                            pass
+                        except OperationalError:
+                            # SQLite: таблица заблокирована другим потоком, повторяем
+                            continue
+                        break
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker) for i in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        self.assertEqual(len(reserved), 10)
+        self.assertEqual(Size.objects.get(id=size.id).qty, 0)
+        self.assertEqual(Product.objects.get(id=product.id).qty, 0)
+
+
+def seed_order(product, customer=None, status=Order.STATUS_NEW):
+    cart = Cart.objects.create(customer=customer, in_order=True, total_product=1, final_price=product.price)
+    CartProduct.objects.bulk_create([CartProduct(customer=customer, cart=cart, product=product, qty=1,
+                                                 final_price=product.price)])
+    return Order.objects.create(customer=customer, cart=cart, first_name='Иван', last_name='Иванов',
+                                phone='+375290000000', address='Минск', status=status)
+
+
+class EmailOutboxTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.categories, cls.products = seed_catalog(categories=1, products=2, sizes_per_product=0)
+
+    def test_checkout_queues_email_instead_of_sending(self):
+        seed_session_cart(self.client, self.products)
+        self.client.post(reverse('make_order'), {
+            'first_name': 'Иван', 'last_name': 'Иванов', 'phone': '+375290000000', 'address': 'Минск',
+            'buying_type': Order.BUYING_TYPE_COURIER, 'payment_type': Order.PAYMENT_TYPE_CASH})
+        order = Order.objects.get()
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(EmailOutbox.objects.get().order, order)
+
+        call_command('send_order_emails', workers=1, stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, 'Заказ #{0}'.format(order.pk))
+        self.assertIn(self.products[0].name, mail.outbox[0].body)
+        self.assertEqual(EmailOutbox.objects.get().status, EmailOutbox.STATUS_SENT)
+
+    @override_settings(EMAIL_OUTBOX_MAX_ATTEMPTS=2)
+    def test_failed_send_is_retried_with_backoff(self):
+        message = EmailOutbox.objects.create(order=seed_order(self.products[0]))
+        with mock.patch('django.core.mail.EmailMessage.send', side_effect=ConnectionError('smtp down')):
+            self.assertEqual(send_pending(), (0, 1))
+        message.refresh_from_db()
+        self.assertEqual(message.status, EmailOutbox.STATUS_PENDING)
+        self.assertEqual(message.attempts, 1)
+        self.assertIn('smtp down', message.last_error)
+        self.assertEqual(send_pending(), (0, 0))
+
+        EmailOutbox.objects.filter(id=message.id).update(available_at=message.created_at)
+        with mock.patch('django.core.mail.EmailMessage.send', side_effect=ConnectionError('smtp down')):
+            self.assertEqual(send_pending(), (0, 1))
+        message.refresh_from_db()
+        self.assertEqual(message.status, EmailOutbox.STATUS_FAILED)
+
+    @override_settings(EMAIL_OUTBOX_MAX_ATTEMPTS=2)
+    def test_build_error_is_retried_and_fails(self):
+        order = seed_order(self.products[0])
+        message = EmailOutbox.objects.create(order=order)
+        Order.objects.filter(id=order.id).update(cart=None)
+        self.assertEqual(send_pending(), (0, 1))
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts), (EmailOutbox.STATUS_PENDING, 1))
+        self.assertIn('AttributeError', message.last_error)
+        EmailOutbox.objects.filter(id=message.id).update(available_at=message.created_at)
+        self.assertEqual(send_pending(), (0, 1))
+        message.refresh_from_db()
+        self.assertEqual(message.status, EmailOutbox.STATUS_FAILED)
+
+    def test_claimed_message_is_not_sent_twice(self):
+        message = EmailOutbox.objects.create(order=seed_order(self.products[0]))
+        EmailOutbox.objects.filter(id=message.id).update(status=EmailOutbox.STATUS_SENDING,
+                                                          locked_at=message.created_at)
+        self.assertEqual(send_pending(), (0, 0))
+        self.assertEqual(len(mail.outbox), 0)
+
+
+class EmailOutboxWorkerPoolTests(TransactionTestCase):
+    def test_thread_pool_sends_each_message_once(self):
+        categories, products = seed_catalog(categories=1, products=1, sizes_per_product=0)
+        for i in range(10):
+            EmailOutbox.objects.create(order=seed_order(products[0]))
+        self.assertEqual(send_pending(workers=4), (10, 0))
+        self.assertEqual(len(mail.outbox), 10)
+        self.assertFalse(EmailOutbox.objects.exclude(status=EmailOutbox.STATUS_SENT).exists())
+
+    def test_thread_error_does_not_abort_batch(self):
+        categories, products = seed_catalog(categories=1, products=1, sizes_per_product=0)
+        messages = [EmailOutbox.objects.create(order=seed_order(products[0])) for i in range(4)]
+        deliver = outbox.deliver
+
+        def flaky(message_id):
+            if message_id == messages[0].id:
+                raise OperationalError('database is locked')
+            return deliver(message_id)
+
+        with mock.patch('shop.outbox.deliver', side_effect=flaky), self.assertLogs('shop.outbox', 'ERROR'):
+            self.assertEqual(send_pending(workers=2), (3, 1))
+        self.assertEqual(len(mail.outbox), 3)
+
+
+class CartRecalcTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.categories, cls.products = seed_catalog(categories=1, products=10, sizes_per_product=0)
+        cls.user = User.objects.create_user('buyer', password='password')
+
+    def setUp(self):
+        self.cart = seed_user_cart(self.user, self.products, lines=10)
+
+    def totals(self):
+        cart = Cart.objects.get(id=self.cart.id)
+        return cart.total_product, cart.final_price
+
+    def test_immediate_recalc_outside_batch(self):
+        line = self.cart.cartproduct_set.first()
+        line.qty = 3
+        line.save()
+        self.assertEqual(self.totals(), (12, sum(p.price for p in self.products) + line.product.price * 2))
+
+    def test_batch_recalculates_each_cart_once(self):
+        lines = list(self.cart.cartproduct_set.select_related('product'))
+        with CaptureQueriesContext(connection) as queries:
+            with defer_recalc():
+                for line in lines:
+                    line.qty = 2
+                    line.save()
+                with defer_recalc():
+                    lines[0].delete()
+                self.assertEqual(self.totals()[0], 10)
+        cart_updates = [q for q in queries if q['sql'].startswith('UPDATE "shop_cart"')]
+        self.assertEqual(len(cart_updates), 1)
+        self.assertEqual(self.totals(), (18, sum(p.price for p in self.products[1:]) * 2))
+
+    def test_batch_does_not_load_carts(self):
+        lines = list(CartProduct.objects.filter(cart_id=self.cart.id).select_related('product'))
+        with CaptureQueriesContext(connection) as queries:
+            with defer_recalc():
+                for line in lines:
+                    line.qty = 2
+                    line.save()
+        cart_selects = [q for q in queries if q['sql'].startswith('SELECT') and 'FROM "shop_cart"' in q['sql']]
+        self.assertEqual(cart_selects, [])
+        self.assertEqual(self.totals()[0], 20)
+
+    def test_request_is_a_batch(self):
+        self.assertIn('shop.middleware.RecalcMiddleware', settings.MIDDLEWARE)
+        self.client.force_login(self.user)
+        line = self.cart.cartproduct_set.select_related('product').first()
+        self.client.post(reverse('change_qty', args=[line.id]), {'qty': 4})
+        self.assertEqual(self.totals()[0], 13)
+
+
+class RepricingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.categories, cls.products = seed_catalog(categories=1, products=5, sizes_per_product=0)
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def setUp(self):
+        self.open_carts = [seed_user_cart(User.objects.create_user('buyer{0}'.format(i)), self.products, lines=2)
+                           for i in range(20)]
+        self.ordered = seed_user_cart(self.open_carts[0].customer, self.products, lines=2, in_order=True)
+
+    def test_price_change_reprices_open_carts_in_bulk(self):
+        product = Product.objects.get(id=self.products[0].id)
+        product.price = Decimal('100.00')
+        with CaptureQueriesContext(connection) as queries:
+            product.save()
+        cart_queries = [q for q in queries if 'shop_cart' in q['sql']]
+        self.assertEqual(len(cart_queries), 2)
+        for cart in Cart.objects.filter(id__in=[cart.id for cart in self.open_carts]):
+            self.assertEqual(cart.final_price, Decimal('100.00') + self.products[1].price)
+        line = CartProduct.objects.get(cart=self.open_carts[0], product=product)
+        self.assertEqual(line.final_price, Decimal('100.00'))
+        ordered = Cart.objects.get(id=self.ordered.id)
+        self.assertEqual(ordered.final_price, self.products[0].price + self.products[1].price)
+
+    def test_save_without_price_change_skips_repricing(self):
+        product = Product.objects.get(id=self.products[0].id)
+        product.name = 'Новое имя'
+        with CaptureQueriesContext(connection) as queries:
+            product.save()
+        self.assertFalse([q for q in queries if 'shop_cartproduct' in q['sql'] and q['sql'].startswith('UPDATE')])
+
+    def test_admin_bulk_price_action(self):
+        self.client.force_login(self.admin)
+        ids = [product.id for product in self.products[:2]]
+        url = reverse('admin:shop_product_changelist')
+        response = self.client.post(url, {'action': 'change_price', '_selected_action': ids})
+        self.assertTemplateUsed(response, 'admin/shop/product/change_price.html')
+        response = self.client.post(url, {'action': 'change_price', '_selected_action': ids, 'apply': '1',
+                                          'mode': 'percent', 'value': '10'})
+        self.assertRedirects(response, url)
+        for product in self.products[:2]:
+            self.assertEqual(Product.objects.get(id=product.id).price,
+                             (product.price * Decimal('1.1')).quantize(Decimal('0.01')))
+        cart = Cart.objects.get(id=self.open_carts[5].id)
+        self.assertEqual(cart.final_price, sum((product.price * Decimal('1.1')).quantize(Decimal('0.01'))
+                                               for product in self.products[:2]))
+
+
+def is_stock_recalc(sql):
+    return sql.startswith('UPDATE "shop_product"') and 'FROM "shop_size"' in sql
+
+
+class StockRecalcTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.category = Category.objects.create(name='Кольца', slug='rings')
+
+    def admin_save(self, sizes):
+        product = Product.objects.create(name='Кольцо {0}'.format(sizes), slug='ring-{0}'.format(sizes),
+                                         category=self.category, image='r.png', qty=0, price=10)
+        data = {
+            'name': product.name, 'category': self.category.id, 'description': '', 'slug': product.slug,
+            'price': '10', 'qty': 0, 'size_set-TOTAL_FORMS': sizes, 'size_set-INITIAL_FORMS': 0,
+            'size_set-MIN_NUM_FORMS': 0, 'size_set-MAX_NUM_FORMS': 1000,
+        }
+        for i in range(sizes):
+            data['size_set-{0}-size'.format(i)] = 15 + i
+            data['size_set-{0}-qty'.format(i)] = 2
+        self.client.force_login(self.admin)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('admin:shop_product_change', args=[product.id]), data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Product.objects.get(id=product.id).qty, sizes * 2)
+        queries = [q['sql'] for q in queries]
+        recalc = [i for i, sql in enumerate(queries) if is_stock_recalc(sql)]
+        release = [i for i, sql in enumerate(queries) if sql.startswith('RELEASE SAVEPOINT')]
+        self.assertLess(recalc[-1], release[-1], 'остаток пересчитан после выхода из транзакции админки')
+        return queries
+
+    def test_admin_save_recomputes_stock_once(self):
+        small, large = self.admin_save(3), self.admin_save(15)
+        for queries in (small, large):
+            self.assertEqual(len([sql for sql in queries if is_stock_recalc(sql)]), 1)
+        recalc = [len([sql for sql in queries if sql.startswith('UPDATE "shop_product"')]) for queries in (small, large)]
+        self.assertEqual(recalc[0], recalc[1])
+
+    def test_batch_size_changes(self):
+        product = Product.objects.create(name='Кольцо', slug='ring', category=self.category, image='r.png',
+                                         qty=0, price=10)
+        with CaptureQueriesContext(connection) as queries:
+            with defer_recalc():
+                for i in range(10):
+                    Size.objects.create(product=product, size=Decimal(15 + i), qty=3)
+                Size.objects.filter(product=product, size=15).delete()
+        self.assertEqual(len([q for q in queries if is_stock_recalc(q['sql'])]), 1)
+        self.assertEqual(Product.objects.get(id=product.id).qty, 27)
+
+    def test_single_size_change_outside_batch(self):
+        product = Product.objects.create(name='Кольцо', slug='ring', category=self.category, image='r.png',
+                                         qty=0, price=10)
+        size = Size.objects.create(product=product, size=Decimal(17), qty=3)
+        self.assertEqual(Product.objects.get(id=product.id).qty, 3)
+        size.delete()
+        self.assertEqual(Product.objects.get(id=product.id).qty, 0)
+
+
+class CatalogImportExportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def export(self, file_format):
+        path = os.path.join(self.dir.name, 'catalog.' + file_format)
+        call_command('export_catalog', format=file_format, output=path, stderr=StringIO())
+        return path
+
+    def test_round_trip(self):
+        category_list, product_list = seed_catalog(categories=3, products=30, sizes_per_product=2)
+        recalc_products([product.id for product in product_list])
+        for file_format in ('csv', 'jsonl'):
+            before = list(iter_catalog())
+            path = self.export(file_format)
+            Category.objects.all().delete()
+            call_command('import_catalog', path, stdout=StringIO())
+            self.assertEqual(list(iter_catalog()), before)
+            self.assertEqual(Product.objects.count(), 30)
+            self.assertEqual(Size.objects.count(), 30)
+            self.assertEqual(Product.objects.get(slug='product-0').qty, 50)
+            self.assertEqual(search_backend.search('Товар 7', Product.objects.all())[:1],
+                             [Product.objects.get(slug='product-7').id])
+
+    def write_rows(self, rows):
+        path = os.path.join(self.dir.name, 'import.jsonl')
+        with open(path, 'w', encoding='utf-8') as stream:
+            for row in rows:
+                stream.write(json.dumps(row, ensure_ascii=False) + '\n')
+        return path
+
+    def product_rows(self, count):
+        yield {'type': 'category', 'slug': 'rings', 'name': 'Кольца'}
+        for i in range(count):
+            yield {'type': 'product', 'slug': 'ring-{0}'.format(i), 'name': 'Кольцо {0}'.format(i),
+                   'category': 'rings', 'price': '10.00', 'qty': 0, 'image': 'ring.jpg'}
+            yield {'type': 'size', 'product': 'ring-{0}'.format(i), 'size': '17.5', 'qty': 4}
+
+    def test_query_count_does_not_grow_with_rows(self):
+        counts = []
+        for count in (10, 100):
+            Category.objects.all().delete()
+            with CaptureQueriesContext(connection) as queries:
+                CatalogImporter(chunk_size=1000).run(self.product_rows(count))
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        product = Product.objects.get(slug='ring-99')
+        self.assertEqual(product.qty, 4)
+        self.assertEqual(product.image.name, 'rings/ring-99.jpg')
+
+    def test_upsert_updates_and_reprices_open_carts(self):
+        category_list, product_list = seed_catalog(categories=1, products=2, sizes_per_product=0)
+        cart = seed_user_cart(User.objects.create_user('buyer'), product_list, lines=2)
+        call_command('import_catalog', self.write_rows([
+            {'type': 'product', 'slug': 'product-0', 'name': 'Новое имя', 'category': category_list[0].slug,
+             'price': '99.00', 'qty': 5},
+        ]), stdout=StringIO())
+        product = Product.objects.get(slug='product-0')
+        self.assertEqual((product.name, product.price, product.qty), ('Новое имя', Decimal('99.00'), 5))
+        self.assertEqual(product.image.name, product_list[0].image.name)
+        self.assertEqual(Product.objects.count(), 2)
+        self.assertEqual(Cart.objects.get(id=cart.id).final_price, Decimal('99.00') + product_list[1].price)
+
+    def test_unknown_category(self):
+        path = self.write_rows([{'type': 'product', 'slug': 'ring', 'name': 'Кольцо', 'category': 'missing',
+                                 'price': '1', 'qty': 1}])
+        with self.assertRaises(CommandError):
+            call_command('import_catalog', path, stdout=StringIO())
+        self.assertFalse(Product.objects.exists())
+
+
+def make_image(width=1000, height=500, file_format='PNG'):
+    buffer = BytesIO()
+    Image.new('RGB', (width, height), (200, 30, 30)).save(buffer, file_format)
+    return buffer.getvalue()
+
+
+class ProductImageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Кольца', slug='rings')
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def create_product(self, slug='ring'):
+        return Product.objects.create(name='Кольцо', slug=slug, category=self.category, qty=1, price=10,
+                                      image=SimpleUploadedFile('photo.png', make_image()))
+
+    def test_derivatives_generated_on_upload(self):
+        product = self.create_product()
+        self.assertEqual(product.image.name, 'rings/ring.png')
+        for name in get_derivative_names(product.image.name):
+            self.assertTrue(default_storage.exists(name), name)
+        with default_storage.open('rings/ring-200w.webp') as file:
+            self.assertEqual(Image.open(file).size, (200, 100))
+        with default_storage.open('rings/ring-800w.png') as file:
+            self.assertEqual(Image.open(file).format, 'PNG')
+
+    def test_derivatives_removed_with_product(self):
+        product = self.create_product()
+        product.delete()
+        self.assertFalse([name for name in get_derivative_names('rings/ring.png') if default_storage.exists(name)])
+
+    def test_srcset_tag(self):
+        product = self.create_product()
+        html = Template('{% load product_images %}{% product_image product.image sizes="25vw" alt=product.name %}'
+                        ).render(Context({'product': product}))
+        self.assertIn('type="image/webp" srcset="/media/rings/ring-200w.webp 200w, /media/rings/ring-400w.webp 400w, '
+                      '/media/rings/ring-800w.webp 800w"', html)
+        self.assertIn('src="/media/rings/ring.png" srcset="/media/rings/ring-200w.png 200w', html)
+
+    def test_backfill_command(self):
+        default_storage.save('rings/old.jpg', SimpleUploadedFile('old.jpg', make_image(file_format='JPEG')))
+        Product.objects.bulk_create([Product(name='Старое', slug='old', category=self.category, qty=1, price=10,
+                                             image='rings/old.jpg')])
+        html = Template('{% load product_images %}{% product_image product.image %}').render(
+            Context({'product': Product.objects.get(slug='old')}))
+        self.assertEqual(html, '<img src="/media/rings/old.jpg" class="" alt="" loading="lazy">')
+        call_command('generate_product_images', workers=2, stdout=StringIO())
+        for name in get_derivative_names('rings/old.jpg'):
+            self.assertTrue(default_storage.exists(name), name)
+        self.assertEqual(Product.objects.get(slug='old').image_widths, '200,400,800')
+
+    def test_narrow_image_is_not_upscaled(self):
+        product = Product.objects.create(name='Кольцо', slug='small', category=self.category, qty=1, price=10,
+                                         image=SimpleUploadedFile('photo.png', make_image(width=300, height=150)))
+        self.assertEqual(product.image_widths, '200')
+        self.assertFalse(default_storage.exists('rings/small-400w.webp'))
+        html = Template('{% load product_images %}{% product_image product.image %}').render(
+            Context({'product': Product.objects.get(id=product.id)}))
+        self.assertIn('srcset="/media/rings/small-200w.webp 200w"', html)
+        self.assertNotIn('400w', html)
+
+
+class SitemapTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def sitemap_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    @override_settings(SITEMAP_PAGE_SIZE=50)
+    def test_index_pages_and_constant_queries(self):
+        seed_catalog(categories=2, products=120, sizes_per_product=0)
+        count, response = self.sitemap_queries('/sitemap.xml')
+        self.assertContains(response, '/sitemap-item.xml?p=3')
+        self.assertNotContains(response, '/sitemap-item.xml?p=4')
+        small, response = self.sitemap_queries('/sitemap-item.xml?p=3')
+        self.assertContains(response, '<lastmod>')
+        self.assertContains(response, '/category-1/product-119/')
+        Product.objects.bulk_create(
+            Product(name='Еще {0}'.format(i), slug='more-{0}'.format(i), category_id=Category.objects.first().id,
+                    image='x.png', qty=1, price=1) for i in range(30))
+        cache.clear()
+        large, response = self.sitemap_queries('/sitemap-item.xml?p=3')
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, 4)
+
+    def test_cached_until_catalog_changes(self):
+        category_list, product_list = seed_catalog(categories=1, products=3, sizes_per_product=0)
+        self.sitemap_queries('/sitemap-item.xml')
+        count, response = self.sitemap_queries('/sitemap-item.xml')
+        self.assertEqual(count, 0)
+        self.assertNotContains(response, 'renamed')
+        product = product_list[0]
+        product.slug = 'renamed'
+        product.save()
+        run_commit_hooks()
+        count, response = self.sitemap_queries('/sitemap-item.xml')
+        self.assertContains(response, '/renamed/')
+
+
+class PageCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.categories, cls.products = seed_catalog(categories=2, products=10, sizes_per_product=2)
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, client, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    def test_anonymous_hit_without_queries(self):
+        for url in (reverse('main_page'), self.categories[0].get_absolute_url(), self.products[1].get_absolute_url(),
+                    reverse('main_page') + '?search=Товар&limit=2'):
+            miss, first = self.get(Client(), url)
+            hit, second = self.get(Client(), url)
+            self.assertGreater(miss, 0)
+            self.assertEqual(hit, 0)
+            self.assertEqual(CSRF_TOKEN_RE.sub(b'', first.content), CSRF_TOKEN_RE.sub(b'', second.content))
+
+    def test_catalog_change_invalidates(self):
+        url = self.products[1].get_absolute_url()
+        self.get(Client(), url)
+        Product.objects.filter(id=self.products[1].id).update(name='Старое имя')
+        self.assertNotContains(self.get(Client(), url)[1], 'Старое имя')
+        Size.objects.create(product=self.products[1], size=Decimal('21.0'), qty=1)
+        run_commit_hooks()
+        self.assertContains(self.get(Client(), url)[1], 'Старое имя')
+
+    def test_csrf_token_is_per_visitor(self):
+        url = self.products[0].get_absolute_url()
+        self.get(Client(), url)
+        client = Client(enforce_csrf_checks=True)
+        count, response = self.get(client, url)
+        self.assertEqual(count, 0)
+        token = response.content.decode().split('name="csrfmiddlewaretoken" value="')[1].split('"')[0]
+        response = client.post(reverse('add_to_cart', args=[self.products[0].slug]),
+                               {'csrfmiddlewaretoken': token, 'size': '15'}, HTTP_REFERER=url)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(client_cart(client)), 1)
+
+    def test_cart_messages_and_users_bypass_cache(self):
+        url = reverse('main_page')
+        self.get(Client(), url)
+        client = Client()
+        seed_session_cart(client, self.products, lines=3)
+        count, response = self.get(client, url)
+        self.assertGreater(count, 0)
+        self.assertContains(response, '<span class="badge badge-pill badge-danger">3</span>')
+
+        client = Client()
+        Product.objects.filter(id=self.products[2].id).update(qty=0)
+        response = client.get(reverse('add_to_cart', args=[self.products[2].slug]), follow=True)
+        self.assertContains(response, 'Товара нет в наличии')
+
+        user = User.objects.create_user('buyer')
+        client = Client()
+        client.force_login(user)
+        self.assertGreater(self.get(client, url)[0], 0)
+
+
+class PageCacheCommitTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.categories, self.products = seed_catalog(categories=1, products=3, sizes_per_product=0)
+        run_commit_hooks()
+
+    def test_page_cached_during_transaction_is_dropped_on_commit(self):
+        url = self.products[0].get_absolute_url()
+        version = get_catalog_version()
+        with transaction.atomic():
+            product = Product.objects.get(id=self.products[0].id)
+            product.name = 'Новое имя'
+            product.save()
+            self.assertEqual(get_catalog_version(), version)
+            Client().get(url)
+        self.assertNotEqual(get_catalog_version(), version)
+        with CaptureQueriesContext(connection) as queries:
+            response = Client().get(url)
+        self.assertGreater(len(queries), 0)
+        self.assertContains(response, 'Новое имя')
+
+
+class CartMixinTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.categories, cls.products = seed_catalog(categories=1, products=3, sizes_per_product=0)
+        cls.user = User.objects.create_user('buyer')
+
+    def test_read_only_views_do_not_create_cart(self):
+        self.client.force_login(self.user)
+        for url in (reverse('main_page'), reverse('cart'), self.products[0].get_absolute_url(), reverse('profile')):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len([q for q in queries if 'FROM "auth_user"' in q['sql']]), 1)
+        self.assertFalse(Cart.objects.exists())
+
+    def test_first_mutation_creates_cart(self):
+        self.client.force_login(self.user)
+        url = reverse('main_page')
+        for product in self.products[:2]:
+            self.client.get(reverse('add_to_cart', args=[product.slug]), HTTP_REFERER=url)
+        cart = Cart.objects.get(customer=self.user)
+        self.assertEqual(cart.total_product, 2)
+        response = self.client.get(reverse('cart'))
+        self.assertEqual(response.context['cart'].cart, cart)
+
+    def test_anonymous_cart_is_shared(self):
+        request = RequestFactory().get('/')
+        request.session = SessionStore()
+        request.user = AnonymousUser()
+        request._messages = FallbackStorage(request)
+        mixin = CartMixin()
+        mixin.request = request
+        self.assertIs(mixin.cart, mixin.cart_view)
+        mixin.cart.add(self.products[0])
+        self.assertEqual(mixin.cart_view.get_total_items(), 1)
+
+
+class CartStorageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.categories, cls.products = seed_catalog(categories=1, products=5, sizes_per_product=0)
+
+    def setUp(self):
+        cache.clear()
+
+    def add(self, product):
+        return self.client.get(reverse('add_to_cart', args=[product.slug]), HTTP_REFERER=reverse('cart'))
+
+    def test_cookie_cart_keeps_sessions_out_of_database(self):
+        for product in self.products[:3]:
+            self.add(product)
+        self.add(self.products[0])
+        cart = client_cart(self.client)
+        self.assertEqual(cart[str(self.products[0].id)]['qty'], 2)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('cart'))
+        self.assertFalse([q for q in queries if 'django_session' in q['sql']])
+        self.assertEqual(response.context['cart'].get_total_items(), 4)
+        self.assertFalse(Session.objects.exists())
+
+    def test_cookie_cart_does_not_write_existing_session(self):
+        session = self.client.session
+        session['visited'] = True
+        session.save()
+        self.add(self.products[0])
+        for product in self.products[1:3]:
+            with CaptureQueriesContext(connection) as queries:
+                self.add(product)
+            self.assertFalse([q for q in queries if 'django_session' in q['sql'] and not q['sql'].startswith('SELECT')])
+        self.assertEqual(len(client_cart(self.client)), 3)
+
+    def test_tampered_cookie_is_ignored(self):
+        self.add(self.products[0])
+        self.client.cookies[settings.CART_COOKIE_NAME] = self.client.cookies[settings.CART_COOKIE_NAME].value + 'x'
+        self.assertEqual(self.client.get(reverse('cart')).context['cart'].get_total_items(), 0)
+
+    @override_settings(CART_COOKIE_MAX_SIZE=60)
+    def test_large_cart_falls_back_to_session(self):
+        for product in self.products:
+            self.add(product)
+        cookie = self.client.cookies.get(settings.CART_COOKIE_NAME)
+        self.assertFalse(cookie and cookie.value)
+        self.assertEqual(len(self.client.session[settings.CART_SESSION_ID]['l']), 5)
+        self.assertEqual(self.client.get(reverse('cart')).context['cart'].get_total_items(), 5)
+
+    def test_legacy_session_cart_moves_to_cookie(self):
+        seed_session_cart(self.client, self.products, lines=2)
+        self.add(self.products[2])
+        self.assertEqual(len(client_cart(self.client)), 3)
+        self.assertNotIn(settings.CART_SESSION_ID, self.client.session)
+
+    @override_settings(CART_STORAGE='shop.cart_storage.CacheCartStorage')
+    def test_cache_storage(self):
+        self.add(self.products[0])
+        self.add(self.products[1])
+        cart_id = signing.loads(self.client.cookies[settings.CART_COOKIE_NAME].value, salt=CART_COOKIE_SALT)
+        self.assertEqual(cache.get('shop:cart:{0}'.format(cart_id))['q'], 2)
+        self.assertEqual(self.client.get(reverse('cart')).context['cart'].get_total_items(), 2)
+
+
+def assert_uses_index(test, queryset, table, index):
+    """
+    План запроса (EXPLAIN QUERY PLAN) использует индекс и не перебирает таблицу целиком.
+    """
+    plan = queryset.explain()
+    test.assertNotRegex(plan, r'SCAN (TABLE )?{0}\b'.format(table), plan)
+    test.assertIn(index, plan)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Планы запросов проверяются на SQLite')
+class QueryPlanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.categories, cls.products = seed_catalog(categories=2, products=20, sizes_per_product=3)
+        cls.users = [User.objects.create_user('buyer{0}'.format(i)) for i in range(5)]
+        for user in cls.users:
+            seed_user_cart(user, cls.products, lines=4)
+            seed_order(cls.products[0], customer=user)
+
+    def test_open_cart_lookup(self):
+        assert_uses_index(self, Cart.objects.filter(customer=self.users[0], in_order=False),
+                          'shop_cart', 'shop_cart_customer_open_idx')
+
+    def test_size_lookup(self):
+        product = self.products[0]
+        assert_uses_index(self, product.size_set.filter(size=Decimal('15.5')), 'shop_size',
+                          'shop_size_product_size_idx')
+
+    def test_cart_line_lookup(self):
+        cart = Cart.objects.filter(customer=self.users[0]).first()
+        size = self.products[0].size_set.first()
+        assert_uses_index(self, CartProduct.objects.filter(customer=self.users[0], cart=cart,
+                                                           product=self.products[0], size=size),
+                          'shop_cartproduct', 'shop_cartproduct_line_idx')
+
+    def test_customer_order_lookup(self):
+        assert_uses_index(self, Order.objects.filter(id=1, customer=self.users[0], status=Order.STATUS_NEW),
+                          'shop_order', 'PRIMARY KEY')
+        assert_uses_index(self, Order.objects.filter(customer=self.users[0], status=Order.STATUS_NEW),
+                          'shop_order', 'shop_order_customer_status_idx')
+
+
+class AdminChangelistTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.categories, cls.products = seed_catalog(categories=2, products=10, sizes_per_product=1)
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.users = [User.objects.create_user('buyer{0:02}'.format(i)) for i in range(25)]
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def add_orders(self, count):
+        for i in range(count):
+            user = self.users[i % len(self.users)]
+            cart = seed_user_cart(user, self.products[i % 5:], lines=3, in_order=True)
+            Order.objects.create(customer=user, cart=cart, first_name='Иван', last_name='Иванов',
+                                 phone='+375290000000', address='Минск')
+
+    def changelist_queries(self, model, **params):
+        url = reverse('admin:shop_{0}_changelist'.format(model))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    def test_changelists_use_constant_queries(self):
+        self.add_orders(5)
+        small = {model: self.changelist_queries(model)[0] for model in ('order', 'cart', 'cartproduct')}
+        self.add_orders(60)
+        large = {model: self.changelist_queries(model)[0] for model in ('order', 'cart', 'cartproduct')}
+        self.assertEqual(small, large)
+        count, response = self.changelist_queries('order')
+        self.assertContains(response, 'Товар 2(1)')
+
+    def test_customer_filter_is_paginated(self):
+        self.add_orders(25)
+        count, response = self.changelist_queries('order')
+        self.assertContains(response, 'buyer19')
+        self.assertNotContains(response, 'buyer20')
+        self.assertContains(response, 'customer_page=2')
+        count, response = self.changelist_queries('order', customer_page=2)
+        self.assertContains(response, 'buyer24')
+        self.assertFalse(response.context['cl'].has_active_filters)
+        self.assertEqual(response.context['cl'].result_count, 25)
+        count, response = self.changelist_queries('order', customer=self.users[3].id)
+        self.assertEqual({order.customer_id for order in response.context['cl'].result_list}, {self.users[3].id})
+
+
+class SalesRollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.categories, cls.products = seed_catalog(categories=2, products=10, sizes_per_product=1)
+        cls.user = User.objects.create_user('buyer')
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def add_order(self, lines=3, offset=0, **kwargs):
+        cart = seed_user_cart(self.user, self.products[offset:], lines=lines, in_order=True)
+        return Order.objects.create(customer=self.user, cart=cart, first_name='Иван', last_name='Иванов',
+                                    phone='+375290000000', address='Минск', **kwargs)
+
+    def totals(self):
+        return list(DailySales.objects.order_by('date', 'product_id', 'size', 'buying_type').values_list(
+            'date', 'category_id', 'product_id', 'size', 'buying_type', 'orders', 'units', 'revenue'))
+
+    def test_order_is_counted_once(self):
+        self.add_order()
+        self.add_order(lines=2)
+        self.assertEqual(DailySales.objects.count(), 3)
+        sales = DailySales.objects.get(product=self.products[0])
+        self.assertEqual((sales.orders, sales.units, sales.revenue), (2, 2, self.products[0].price * 2))
+        self.assertEqual(sales.size, Size.objects.get(product=self.products[0]).size)
+        self.assertEqual(DailySales.objects.get(product=self.products[1]).size, 0)
+
+    def test_status_changes_update_rollup(self):
+        order = self.add_order()
+        order.status = Order.STATUS_COMPLETED
+        order.save()
+        self.assertEqual(DailySales.objects.filter(orders=1).count(), 3)
+        order.status = Order.STATUS_CANCEL
+        order.save()
+        self.assertFalse(DailySales.objects.exists())
+        order = Order.objects.get(id=order.id)
+        order.status = Order.STATUS_IN_PROGRESS
+        order.buying_type = Order.BUYING_TYPE_DELIVERY
+        order.save()
+        self.assertEqual(set(DailySales.objects.values_list('buying_type', flat=True)), {Order.BUYING_TYPE_DELIVERY})
+
+    def test_status_change_on_later_day_keeps_order_day(self):
+        order = self.add_order()
+        before = self.totals()
+        later = timezone.now() + timedelta(days=3)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            order = Order.objects.get(id=order.id)
+            order.status = Order.STATUS_COMPLETED
+            order.save()
+            call_command('rebuild_sales_rollup', stdout=StringIO())
+        self.assertEqual(self.totals(), before)
+
+    def test_deleted_order_is_removed(self):
+        self.add_order()
+        order = self.add_order(lines=1)
+        Order.objects.get(id=order.id).delete()
+        self.assertEqual(DailySales.objects.get(product=self.products[0]).orders, 1)
+        Order.objects.only('id', 'cart').get(id=order.id - 1).delete()
+        self.assertFalse(DailySales.objects.exists())
+
+    def test_rebuild_matches_incremental(self):
+        for i in range(7):
+            order = self.add_order(lines=1 + i % 3, offset=i % 4)
+            if i % 3 == 0:
+                order.status = Order.STATUS_CANCEL
+                order.save()
+        incremental = self.totals()
+        out = StringIO()
+        call_command('rebuild_sales_rollup', chunk_size=2, stdout=out)
+        self.assertIn('4', out.getvalue())
+        self.assertEqual(self.totals(), incremental)
+
+    def test_rebuild_replaces_rows_in_one_transaction(self):
+        self.add_order()
+        before = self.totals()
+        with mock.patch.object(DailySales.objects, 'bulk_create', side_effect=OperationalError('database is locked')):
+            with self.assertRaises(OperationalError):
+                call_command('rebuild_sales_rollup', stdout=StringIO())
+        self.assertEqual(self.totals(), before)
+
+    def test_dashboard_reads_only_rollups(self):
+        self.add_order()
+        self.client.force_login(self.admin)
+        url = reverse('admin:shop_dailysales_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Категория 0')
+        tables = {table for query in queries.captured_queries for table in ('shop_order', 'shop_cart"')
+                  if table in query['sql']}
+        self.assertEqual(tables, set())
+
+
+class OrderExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.categories, cls.products = seed_catalog(categories=2, products=10, sizes_per_product=1)
+        cls.user = User.objects.create_user('buyer')
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.orders = []
+        for i in range(5):
+            cart = seed_user_cart(cls.user, cls.products[i:], lines=2, in_order=True)
+            cls.orders.append(Order.objects.create(
+                customer=cls.user, cart=cart, first_name='Иван', last_name='Иванов', phone='+375290000000',
+                address='Минск', status=Order.STATUS_CANCEL if i == 4 else Order.STATUS_COMPLETED))
+        Order.objects.filter(id=cls.orders[0].id).update(created_at='2020-01-15T12:00:00Z')
+
+    def export(self, **options):
+        out = StringIO()
+        call_command('export_orders', stdout=out, **options)
+        return out.getvalue()
+
+    def test_csv_has_row_per_line(self):
+        rows = list(csv.DictReader(StringIO(self.export(status=[Order.STATUS_COMPLETED]))))
+        self.assertEqual(len(rows), 8)
+        self.assertEqual({row['status'] for row in rows}, {Order.STATUS_COMPLETED})
+        first = [row for row in rows if row['id'] == str(self.orders[1].id)]
+        self.assertEqual([row['product'] for row in first], ['Товар 1', 'Товар 2'])
+        self.assertEqual(first[0]['size'], '')
+        self.assertEqual(first[1]['size'], '15')
+        self.assertEqual(first[0]['customer'], 'buyer')
+
+    def test_csv_escapes_formulas(self):
+        Order.objects.filter(id=self.orders[1].id).update(first_name='=HYPERLINK("http://x")', comment='@SUM(A1)')
+        rows = {row['id']: row for row in csv.DictReader(StringIO(self.export()))}
+        row = rows[str(self.orders[1].id)]
+        self.assertEqual(row['first_name'], '\'=HYPERLINK("http://x")')
+        self.assertEqual(row['comment'], "'@SUM(A1)")
+        self.assertEqual(row['phone'], "'+375290000000")
+        self.assertEqual(row['last_name'], 'Иванов')
+        orders = [json.loads(line) for line in self.export(format='jsonl').splitlines()]
+        self.assertIn('=HYPERLINK("http://x")', [order['first_name'] for order in orders])
+
+    def test_jsonl_filters_by_date(self):
+        orders = [json.loads(line) for line in self.export(format='jsonl', date_to='2020-12-31').splitlines()]
+        self.assertEqual([order['id'] for order in orders], [self.orders[0].id])
+        self.assertEqual(len(orders[0]['lines']), 2)
+        self.assertTrue(orders[0]['created_at'].startswith('2020-01-15'))
+        orders = self.export(format='jsonl', date_from='2021-01-01').splitlines()
+        self.assertEqual(len(orders), 4)
+
+    def test_queries_per_chunk(self):
+        chunks = stream_orders(Order.objects.all(), 'jsonl', chunk_size=2)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(len(next(chunks).splitlines()), 1)
+        self.assertEqual(len(queries), 2)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(len(list(chunks)), 4)
+        self.assertEqual(len(queries), 2)
+
+    def test_admin_action_streams(self):
+        url = reverse('admin:shop_order_changelist')
+        data = {'action': 'export_csv', '_selected_action': [order.id for order in self.orders[:2]]}
+        self.client.force_login(self.admin)
+        response = self.client.post(url, data)
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment', response['Content-Disposition'])
+        rows = list(csv.DictReader(StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(len(rows), 4)
+        self.client.force_login(self.user)
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+
+
+class CatalogApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.categories, cls.products = seed_catalog(categories=2, products=10, sizes_per_product=2)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_products_are_paginated(self):
+        Size.objects.filter(product=self.products[0], size=Decimal('15.5')).update(qty=0)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('api_products'), {'limit': 4})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Cookie', response.get('Vary', ''))
+        self.assertIn('public', response['Cache-Control'])
+        data = response.json()
+        self.assertEqual([product['slug'] for product in data['results']],
+                         ['product-9', 'product-8', 'product-7', 'product-6'])
+        self.assertIsNone(data['previous'])
+        data = self.client.get(data['next']).json()
+        self.assertEqual(data['results'][0]['slug'], 'product-5')
+        self.assertIsNotNone(data['previous'])
+        product = self.client.get(reverse('api_product_detail', args=['product-0'])).json()
+        self.assertEqual(product['sizes'], [{'size': '15', 'qty': 25}])
+        self.assertEqual(product['description'], 'Описание товара 0')
+
+    def test_filters_and_search(self):
+        data = self.client.get(reverse('api_products'), {'category': 'category-1'}).json()
+        self.assertEqual({product['category'] for product in data['results']}, {'category-1'})
+        self.assertEqual(len(data['results']), 5)
+        search_backend.rebuild()
+        data = self.client.get(reverse('api_products'), {'search': 'Товар 3'}).json()
+        self.assertEqual(data['results'][0]['slug'], 'product-3')
+        data = self.client.get(reverse('api_categories')).json()
+        self.assertEqual({category['slug']: category['products'] for category in data['results']},
+                         {'category-0': 5, 'category-1': 5})
+        self.assertEqual(self.client.get(reverse('api_product_detail', args=['missing'])).status_code, 404)
+
+    def test_conditional_get(self):
+        url = reverse('api_products')
+        response = self.client.get(url)
+        etag, modified = response['ETag'], response['Last-Modified']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=modified).status_code, 304)
+        product = Product.objects.get(id=self.products[0].id)
+        product.price = Decimal('99.00')
+        product.save()
+        run_commit_hooks()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=modified).status_code, 200)
@@ -1,8 +1,9 @@
 from django.urls import path
-from . import views
+from . import api, views
 
 urlpatterns = [
     path('', views.MainPageView.as_view(), name='main_page'),
+    path('search/suggest/', views.SuggestView.as_view(), name='search_suggest'),
     path('product/<str:category>/<str:slug>/', views.DetailProductView.as_view(), name='product_detail'),
     path('product/<str:slug>', views.DetailCategoryView.as_view(), name='category_detail'),
     path('cart/', views.CartView.as_view(), name='cart'),
@@ -11,4 +12,7 @@ urlpatterns = [
     path('change-qty/<str:id>/', views.ChangeQTYView.as_view(), name='change_qty'),
     path('checkout/', views.CheckoutView.as_view(), name='checkout'),
     path('make-order/', views.MakeOrderView.as_view(), name='make_order'),
+    path('api/categories/', api.CategoryListApiView.as_view(), name='api_categories'),
+    path('api/products/', api.ProductListApiView.as_view(), name='api_products'),
+    path('api/products/<str:slug>/', api.ProductDetailApiView.as_view(), name='api_product_detail'),
 ]
@@ -1,33 +1,47 @@
-from .models import Category, Cart, CartProduct, Order, Size
-from django.views.generic.detail import SingleObjectMixin
-from django.db import models
-from django.shortcuts import get_object_or_404
-from django.contrib.auth.models import User
-from django.db.models.signals import post_save, post_delete
+import hashlib
+import re
+from .models import Category, Cart, CartProduct, Order, Product, Size
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.db import models, transaction
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.functional import cached_property
+from django.db.models.signals import post_save, post_delete, pre_delete
 from django.dispatch import receiver
 from .cart import CartSession, CartUserView
+from .cart_storage import has_cart_items
+from .services import bump_catalog_version, clear_category_cache, get_catalog_version
+from .search import search_backend
+from .suggest import suggest_index
+from .images import delete_derivatives
+from .analytics import get_sale_state, update_order_sales
+from .recalc import schedule_cart_recalc, schedule_product_recalc, recalc_products
 
 
-class CategoryMixin(SingleObjectMixin):
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context['categories'] = Category.objects.all()
-        return context
+class CartMixin(object):
+    """
+    Корзина текущего посетителя, загружается при первом обращении. cart_view - для отображения,
+    cart - для изменения: у пользователя строка Cart создается только при первом изменении,
+    у анонимного посетителя оба атрибута - один и тот же объект CartSession.
+    """
 
+    @cached_property
+    def cart_view(self):
+        if self.request.user.is_authenticated:
+            cart = Cart.objects.filter(customer=self.request.user, in_order=False).first()
+            return CartUserView(cart or Cart(customer=self.request.user))
+        return CartSession(self.request)
 
-class CartMixin(object):
-    def dispatch(self, request, *args, **kwargs):
-        if request.user.is_authenticated:
-            user = get_object_or_404(User, username=request.user.username)
-            cart = Cart.objects.filter(customer=user, in_order=False).first()
-            if not cart:
-                cart = Cart.objects.create(customer=user)
-            self.cart = cart
-            self.cart_view = CartUserView(cart)
-        else:
-            self.cart = CartSession(request)
-            self.cart_view = CartSession(request)
-        return super().dispatch(request, *args, **kwargs)
+    @property
+    def cart(self):
+        if self.request.user.is_authenticated:
+            cart = self.cart_view.cart
+            if cart.pk is None:
+                cart.save()
+            return cart
+        return self.cart_view
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -35,9 +49,56 @@ class CartMixin(object):
         return context
 
 
+CSRF_TOKEN_RE = re.compile(rb'name="csrfmiddlewaretoken" value="[^"]*"')
+CSRF_TOKEN_PLACEHOLDER = b'name="csrfmiddlewaretoken" value="__csrf_token__"'
+
+
+def is_page_cacheable(request):
+    """
+    Кэшируются только GET-запросы анонимных посетителей с пустой корзиной и без сообщений:
+    у остальных в шаблоне есть данные конкретного посетителя.
+    """
+    return (request.method in ('GET', 'HEAD') and not request.user.is_authenticated
+            and not has_cart_items(request) and not len(get_messages(request)))
+
+
+def get_page_cache_key(request):
+    url = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    return 'shop:page:{0}:{1}'.format(get_catalog_version(), url)
+
+
+class PageCacheMixin(object):
+    """
+    Кэш страниц каталога для анонимных посетителей. Ключ включает поколение каталога,
+    поэтому любое изменение товаров, размеров или категорий делает старые страницы недоступными.
+    CSRF-токен в кэше заменяется заглушкой и подставляется для каждого посетителя.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        if not is_page_cacheable(request):
+            return super().dispatch(request, *args, **kwargs)
+        key = get_page_cache_key(request)
+        cached = cache.get(key)
+        if cached is None:
+            response = super().dispatch(request, *args, **kwargs)
+            if response.status_code == 200:
+                if hasattr(response, 'render'):
+                    response.render()
+                content = CSRF_TOKEN_RE.sub(CSRF_TOKEN_PLACEHOLDER, response.content)
+                cache.set(key, (content, response['Content-Type']), settings.PAGE_CACHE_TIMEOUT)
+            return response
+        content, content_type = cached
+        if CSRF_TOKEN_PLACEHOLDER in content:
+            token = 'name="csrfmiddlewaretoken" value="{0}"'.format(get_token(request))
+            content = content.replace(CSRF_TOKEN_PLACEHOLDER, token.encode())
+        return HttpResponse(content, content_type=content_type)
+
+
 @receiver(post_delete, sender=CartProduct)
 @receiver(post_save, sender=CartProduct)
 def recalc_cart(sender, instance, **kwargs):
+    if schedule_cart_recalc(instance.cart_id):
+        return
     cart = instance.cart
     cart_data = cart.cartproduct_set.all().aggregate(models.Sum('final_price'), models.Sum('qty'))
     if cart_data.get('final_price__sum') and cart_data.get('qty__sum'):
@@ -49,6 +110,11 @@ def recalc_cart(sender, instance, **kwargs):
     cart.save()
 
 
+@receiver(pre_delete, sender=Order)
+def remove_order_sales(sender, instance, **kwargs):
+    update_order_sales(instance, getattr(instance, '_loaded_sale', None) or get_sale_state(instance))
+
+
 @receiver(post_delete, sender=Order)
 def delete_order(sender, instance, **kwargs):
     cart = instance.cart
@@ -62,10 +128,48 @@ def delete_order(sender, instance, **kwargs):
 @receiver(post_delete, sender=Size)
 @receiver(post_save, sender=Size)
 def recalc_qty_product(instance, **kwargs):
-    product = instance.product
-    product_qty = product.size_set.all().aggregate(models.Sum('qty'))
-    if product_qty.get('qty__sum'):
-        product.qty = product_qty['qty__sum']
-    else:
-        product.qty = 0
-    product.save()
\ No newline at end of file
+    if not schedule_product_recalc(instance.product_id):
+        recalc_products([instance.product_id])
+
+
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Product)
+def invalidate_category_cache(**kwargs):
+    transaction.on_commit(clear_category_cache)
+
+
+@receiver(post_delete, sender=Size)
+@receiver(post_save, sender=Size)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Product)
+def invalidate_catalog_pages(**kwargs):
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=Product)
+def index_product(instance, **kwargs):
+    search_backend.update([instance])
+    suggest_index.update([instance])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(instance, **kwargs):
+    search_backend.remove([instance.pk])
+    suggest_index.remove([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def delete_product_images(instance, **kwargs):
+    delete_derivatives(instance.image.name)
+
+
+@receiver(post_save, sender=Category)
+def index_category_products(instance, created, **kwargs):
+    if not created:
+        products = list(instance.product_set.select_related('category'))
+        search_backend.update(products)
+        suggest_index.update(products)
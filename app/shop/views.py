@@ -1,27 +1,41 @@
 from django.shortcuts import render, redirect
+from django.http import JsonResponse
 from django.views import View
 from django.views.generic import DetailView
-from .utils import CategoryMixin, CartMixin
+from .utils import CartMixin, PageCacheMixin
 from .forms import OrderForm
+from .suggest import get_suggestions
+from .stock import OutOfStock
+from .outbox import queue_order_email
 from django.db import transaction
 from .services import *
 
 
-class MainPageView(CartMixin, View):
+class MainPageView(PageCacheMixin, CartMixin, View):
     template_name = 'shop/main_page_shop.html'
+    fragment_template_name = 'shop/product_list.html'
 
     def get(self, request):
         products = get_products(request)
-        categories = get_category()
+        if request.GET.get('fragment'):
+            return render(request, self.fragment_template_name, {'products': products})
         context = {
             'products': products,
-            'categories': categories,
             'cart': self.cart_view,
         }
         return render(request, self.template_name, context)
 
 
-class DetailProductView(CartMixin, CategoryMixin, DetailView):
+class SuggestView(View):
+    def get(self, request):
+        try:
+            limit = int(request.GET.get('limit', 0))
+        except ValueError:
+            limit = 0
+        return JsonResponse({'results': get_suggestions(request.GET.get('q', ''), limit)})
+
+
+class DetailProductView(PageCacheMixin, CartMixin, DetailView):
     template_name = 'shop/product_detail.html'
     context_object_name = 'product'
 
@@ -35,16 +49,17 @@ class DetailProductView(CartMixin, CategoryMixin, DetailView):
         return context
 
 
-class DetailCategoryView(CartMixin, View):
+class DetailCategoryView(PageCacheMixin, CartMixin, View):
     template_name = 'shop/category_detail.html'
+    fragment_template_name = 'shop/product_list.html'
 
     def get(self, request, slug):
         products = get_category_products(slug, request)
-        categories = get_category()
+        if request.GET.get('fragment'):
+            return render(request, self.fragment_template_name, {'products': products})
         context = {
             'category_name': get_category_name(slug),
             'products': products,
-            'categories': categories,
             'cart': self.cart_view,
         }
         return render(request, self.template_name, context)
@@ -54,9 +69,7 @@ class CartView(CartMixin, View):
     template_name = 'shop/cart.html'
 
     def get(self, request):
-        categories = get_category()
         context = {
-            'categories': categories,
             'cart': self.cart_view
         }
         return render(request, self.template_name, context)
@@ -108,20 +121,18 @@ class CheckoutView(CartMixin, View):
     template_name = 'shop/checkout.html'
 
     def get(self, request):
+        if not self.cart_view.get_total_items():
+            messages.error(request, "Ваша корзина покупок пуста")
+            return redirect('main_page')
         if request.user.is_authenticated:
             if validation_checkout_user(request, self.cart):
                 return redirect('cart')
         else:
             if validation_checkout_anonymous_user(request, self.cart):
                 return redirect('cart')
-        categories = get_category()
-        if not self.cart_view.get_total_items():
-            messages.error(request, "Ваша корзина покупок пуста")
-            return redirect('main_page')
         form = OrderForm(request.POST or None)
         context = {
             'cart': self.cart_view,
-            'categories': categories,
             'form': form
         }
         return render(request, self.template_name, context)
@@ -133,11 +144,16 @@ class MakeOrderView(CartMixin, View):
         form = OrderForm(request.POST)
         if form.is_valid():
             order = form.save(commit=False)
-            if request.user.is_authenticated:
-                make_order_user(request, order, self.cart)
-            else:
-                make_order_anonymous_user(self.cart, order)
-            email_message(order)
+            try:
+                if request.user.is_authenticated:
+                    make_order_user(request, order, self.cart)
+                else:
+                    make_order_anonymous_user(self.cart, order)
+            except OutOfStock as error:
+                for line in error.lines:
+                    messages.error(request, 'Осталось только {0} товара {1}'.format(line.available, line))
+                return redirect('cart')
+            queue_order_email(order)
             messages.success(request, "Заказ оформлен")
             return redirect('main_page')
         return redirect('cart')